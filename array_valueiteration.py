@@ -0,0 +1,125 @@
+"""
+array_valueiteration.py
+Value iteration on NumPy arrays. Every sweep backs up the whole grid at once using shifted copies of the
+value array instead of moving the agent around cell by cell. Gives the same numbers as valueiteration.iterate.
+"""
+
+import numpy as np
+from grid_world import GridWorld
+from grid_store import EMPTY, BOULDER
+from action import Action
+from instrumentation import Timer
+
+
+class ArrayGrid:
+    '''
+    Holds the values, rewards and boulder/exit masks of a GridWorld as [y][x] arrays.
+    values and rewards share memory with the grid world's GridStore
+    '''
+
+    def __init__(self, grid_world: GridWorld):
+        store = grid_world.grid
+        shape = (store.height, store.width)
+        self.values = np.frombuffer(store.values).reshape(shape)
+        self.rewards = np.frombuffer(store.rewards).reshape(shape)
+        self._set_cells(np.frombuffer(store.cell_types, dtype=np.uint8).reshape(shape),
+                        grid_world.noise, grid_world.transition_cost, grid_world.discount,
+                        grid_world.action_noises, grid_world.agent_actions)
+
+    # builds an ArrayGrid for a [y][x] array of cell types without a GridWorld, e.g. for a block of rows of a grid
+    # in another process. It has no values or rewards, only sweep and the functions it uses work on it.
+    # The cells on the edge of the array are treated as the edge of the grid
+    @classmethod
+    def from_cells(cls, cell_types, noise, transition_cost, discount, action_noises, agent_actions):
+        grid = cls.__new__(cls)
+        grid._set_cells(cell_types, noise, transition_cost, discount, action_noises, agent_actions)
+        return grid
+
+    def _set_cells(self, cell_types, noise, transition_cost, discount, action_noises, agent_actions):
+        self.noise = noise
+        self.transition_cost = transition_cost
+        self.discount = discount
+        self.action_noises = action_noises
+        self.agent_actions = agent_actions
+        self.empty = cell_types == EMPTY
+        self.boulders = cell_types == BOULDER
+        self.exits = ~(self.empty | self.boulders)
+        self.blocked = {action: self._blocked(action) for action in self.agent_actions}
+
+    # returns a mask of the cells where trying to take an action leaves the agent where it is
+    def _blocked(self, action):
+        blocked = np.ones(self.boulders.shape, dtype=bool)
+        if action == Action.UP:
+            blocked[1:, :] = self.boulders[:-1, :]
+        elif action == Action.DOWN:
+            blocked[:-1, :] = self.boulders[1:, :]
+        elif action == Action.LEFT:
+            blocked[:, 1:] = self.boulders[:, :-1]
+        elif action == Action.RIGHT:
+            blocked[:, :-1] = self.boulders[:, 1:]
+        return blocked
+
+    # returns, for every cell, the value of the cell the agent lands in after taking an action
+    def shifted(self, values, action):
+        moved = values.copy()
+        if action == Action.UP:
+            moved[1:, :] = values[:-1, :]
+        elif action == Action.DOWN:
+            moved[:-1, :] = values[1:, :]
+        elif action == Action.LEFT:
+            moved[:, 1:] = values[:, :-1]
+        elif action == Action.RIGHT:
+            moved[:, :-1] = values[:, 1:]
+        return np.where(self.blocked[action], values, moved)
+
+    # Gets the value of taking an action in every cell wrt noise, same order of operations as
+    # GridWorld.get_weighted_action_reward so the results match exactly
+    def weighted_action_rewards(self, values, desired_action):
+        reward = np.zeros(values.shape)
+        for action in self.action_noises[desired_action]:
+            reward += (self.transition_cost + self.shifted(values, action) * self.discount) * self.noise / 2
+        reward += (self.transition_cost + self.shifted(values, desired_action) * self.discount) * (1 - self.noise)
+        return reward
+
+    # does a single synchronous bellman backup of the whole grid, returns the new values
+    def sweep(self, values):
+        best_reward = None
+        for action in self.agent_actions:
+            reward = self.weighted_action_rewards(values, action)
+            best_reward = reward if best_reward is None else np.maximum(best_reward, reward)
+        return np.where(self.empty, best_reward, values)
+
+    # copies values back into the grid world's store
+    def write_values(self, values):
+        self.values[...] = values
+
+
+# Does value iteration, accepts a GridWorld instance a number of steps k to do.
+# Drop in replacement for valueiteration.iterate, takes the same tolerance for stopping early.
+# There is no in_place option, a vectorized sweep always backs up every state from the previous sweep's values
+# recorder: optional instrumentation.Recorder, gets a record per sweep and a summary
+# returns a tuple of (number of sweeps done, residual of the last sweep)
+def iterate(grid_world: GridWorld, k: int, tolerance=None, recorder=None):
+    timer = Timer()
+    arrays = ArrayGrid(grid_world)
+    backups = int(np.count_nonzero(arrays.empty))
+    values = arrays.values.copy()
+    sweeps = 0
+    residual = None
+    while sweeps < k:
+        new_values = arrays.sweep(values)
+        residual = float(np.max(np.abs(new_values - values), initial=0))
+        values = new_values
+        sweeps += 1
+        if recorder is not None:
+            recorder.record("sweep", solver="array_valueiteration", sweep=sweeps,
+                            residual=residual, backups=backups, seconds=timer.lap())
+        if tolerance is not None and residual < tolerance:
+            break
+    arrays.write_values(values)
+    grid_world.grid.values_changed()
+    if recorder is not None:
+        recorder.record("solve", solver="array_valueiteration", sweeps=sweeps,
+                        residual=residual, backups=sweeps * backups,
+                        seconds=timer.total())
+    return sweeps, residual
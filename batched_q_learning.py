@@ -0,0 +1,85 @@
+"""
+batched_q_learning.py
+Vectorized Q learning. N agents walk the same grid at once and share one q table, every step picks the actions,
+samples the noise, moves the agents and does the TD updates for all of them with NumPy array operations.
+Each agent step follows the same rules as q_value_learning.iterate.
+"""
+
+import random
+import numpy as np
+from grid_world import GridWorld
+from instrumentation import Timer
+from grid_store import EXIT
+
+
+class BatchedAgents:
+    '''
+    NumPy views of a grid world's q table and values plus the positions of N agents
+    '''
+
+    def __init__(self, grid_world: GridWorld, agents: int, seed=None):
+        store = grid_world.grid
+        size = store.width * store.height
+        # views share memory with the grid world's GridStore, so updates show up in the grid world
+        self.q_values = np.frombuffer(store.q_values).reshape(size, 4)
+        self.known_values = np.frombuffer(store.known_values)
+        self.values = np.frombuffer(store.values)
+        self.exits = np.frombuffer(store.cell_types, dtype=np.uint8) == EXIT
+        # where each action (by action value) actually takes the agent, successors[state][action]
+        self.successors = np.frombuffer(grid_world.successors, dtype=np.int32).reshape(size, 4, 3)[:, :, 2]
+        # the two actions the noise can turn each action into
+        self.noise_actions = np.array(
+            [[noise_action.value for noise_action in grid_world.action_noises[action]]
+             for action in grid_world.agent_actions])
+        self.noise = grid_world.noise
+        self.transition_cost = grid_world.transition_cost
+        self.discount = grid_world.discount
+        self.start = grid_world.state_index(grid_world.start_x, grid_world.start_y)
+        self.states = np.full(agents, self.start)
+        # seeded from the random module so random.seed() keeps runs reproducible
+        if seed is None:
+            seed = random.getrandbits(64)
+        self.rng = np.random.default_rng(seed)
+
+    # picks the greedy action of every agent, ties are broken randomly like q_value_learning.get_policy
+    def get_policies(self, states):
+        q_values = self.q_values[states]
+        best = q_values == q_values.max(axis=1, keepdims=True)
+        return np.argmax(np.where(best, self.rng.random(q_values.shape), -1), axis=1)
+
+    # advances the first n agents by one step and updates the shared q table
+    # returns how many agents reached an exit
+    def step(self, n, alpha):
+        states = self.states[:n]
+        actions = self.get_policies(states)
+        noisy = self.rng.random(n) <= self.noise
+        sides = self.rng.integers(0, 2, n)
+        taken = np.where(noisy, self.noise_actions[actions, sides], actions)
+        next_states = self.successors[states, taken]
+        rewards = self.transition_cost + self.known_values[next_states] * self.discount
+        # agents updating the same q state in the same step overwrite each other, the last one wins
+        self.q_values[states, actions] = self.q_values[states, actions] * (1 - alpha) + alpha * rewards
+        self.known_values[states] = self.q_values[states].max(axis=1)
+        done = self.exits[next_states]
+        self.known_values[next_states[done]] = self.values[next_states[done]]
+        next_states[done] = self.start
+        self.states[:n] = next_states
+        return int(np.count_nonzero(done))
+
+
+# Does Q Value Learning with a batch of agents, accepts a GridWorld instance, a number of episodes, an alpha value
+# and the number of agents. The episodes are spread across the agents, so eps agent steps are taken in total.
+# Every call starts the agents from the start state
+# recorder: optional instrumentation.Recorder, gets a summary of the call
+def iterate(grid_world: GridWorld, eps: int, alpha: float, agents=64, seed=None, recorder=None):
+    timer = Timer()
+    batch = BatchedAgents(grid_world, agents, seed)
+    episodes = 0
+    for i in range(eps // agents):
+        episodes += batch.step(agents, alpha)
+    if eps % agents:
+        episodes += batch.step(eps % agents, alpha)
+    grid_world.reset(random=False)
+    if recorder is not None:
+        recorder.record("solve", solver="batched_q_learning", steps=eps, agents=agents,
+                        episodes=episodes, seconds=timer.total())
@@ -0,0 +1,200 @@
+"""
+benchmark.py
+Benchmarks the solvers on generated grids of any size. Generates grid files with a chosen size, boulder density,
+number of terminals, noise and discount, then times grid parsing, value iteration (backups and sweeps per second),
+Q learning (steps per second) and records the peak memory of each. Results are saved as JSON so a later run can be
+compared against them to catch slowdowns.
+
+python benchmark.py --sizes 50 200 --output baseline.json
+python benchmark.py --sizes 50 200 --baseline baseline.json
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import valueiteration
+import q_value_learning
+import reader
+
+# NumPy is optional, without it the array based solvers are skipped
+try:
+    import array_valueiteration
+    import batched_q_learning
+except ImportError:
+    array_valueiteration = None
+    batched_q_learning = None
+
+
+def generate_grid(path: str, width: int, height: int, boulder_density=0.1,
+                  terminals=4, noise=0.2, discount=0.9, transition_cost=-0.1,
+                  seed=0):
+    '''
+    Writes a random grid file in the same format as grid.txt. Half of the terminals are +10 and half -10,
+    boulder_density is the fraction of cells that are boulders
+    '''
+    rng = random.Random(seed)
+    cells = rng.sample(range(width * height),
+                       terminals + int(boulder_density * width * height) + 1)
+    start = cells[0]
+    exits = cells[1:terminals + 1]
+    boulders = cells[terminals + 1:]
+    with open(path, "w") as file:
+        file.write("Horizontal=" + str(width) + "\n")
+        file.write("Vertical=" + str(height) + "\n")
+        file.write("Terminal={" + ",".join(
+            "{}={{{},{},{}}}".format(i + 1, cell % width, cell // width,
+                                     "+10" if i % 2 == 0 else "-10")
+            for i, cell in enumerate(exits)) + "}\n")
+        file.write("Boulder={" + ",".join(
+            "{}={{{},{}}}".format(i + 1, cell % width, cell // width)
+            for i, cell in enumerate(boulders)) + "}\n")
+        file.write("RobotStartState={" + str(start % width) + "," +
+                   str(start // width) + "}\n")
+        file.write("K=100\nEpisodes=1000\n")
+        file.write("Discount=" + str(discount) + "\n")
+        file.write("alpha=0.2\n")
+        file.write("Noise=" + str(noise) + "\n")
+        file.write("TransitionCost=" + str(transition_cost) + "\n")
+
+
+def measure(setup, function, memory=True):
+    '''
+    Times function(*setup()), then runs it again on a fresh setup under tracemalloc to get its peak memory
+    (tracing slows it down too much to time it at the same time).
+    Returns (seconds taken, peak bytes allocated or None)
+    '''
+    args = setup()
+    random.seed(0)
+    start = time.perf_counter()
+    function(*args)
+    seconds = time.perf_counter() - start
+    peak = None
+    if memory:
+        args = setup()
+        random.seed(0)
+        tracemalloc.start()
+        try:
+            function(*args)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return seconds, peak
+
+
+def _result(name, size, seconds, peak, units=None, count=None):
+    result = {"name": name, "size": size, "seconds": seconds,
+              "peak_memory": peak}
+    if units is not None:
+        result[units + "_per_second"] = count / seconds if seconds else None
+    return result
+
+
+def run_benchmarks(grid_file: str, size: str, sweeps: int, steps: int, memory=True):
+    '''
+    Runs every benchmark on one grid file, returns a list of results
+    '''
+    results = []
+    seconds, peak = measure(lambda: (grid_file, ), reader.read_grid, memory)
+    results.append(_result("read_grid", size, seconds, peak))
+
+    (grid, k, eps, a) = reader.read_grid(grid_file)
+    empty = sum(grid.is_cell(x, y) for y in range(grid.height)
+                for x in range(grid.width))
+    solvers = [("valueiteration", valueiteration)]
+    if array_valueiteration is not None:
+        solvers.append(("array_valueiteration", array_valueiteration))
+    for name, solver in solvers:
+        seconds, peak = measure(lambda: (reader.read_grid(grid_file)[0], sweeps),
+                                solver.iterate, memory)
+        results.append(_result(name, size, seconds, peak, "sweeps", sweeps))
+        results[-1]["backups_per_second"] = empty * sweeps / seconds if seconds else None
+
+    learners = [("q_value_learning", q_value_learning, steps)]
+    if batched_q_learning is not None:
+        learners.append(("batched_q_learning", batched_q_learning, steps * 10))
+    for name, learner, count in learners:
+        seconds, peak = measure(lambda: (reader.read_grid(grid_file)[0], count, a),
+                                learner.iterate, memory)
+        results.append(_result(name, size, seconds, peak, "steps", count))
+    return results
+
+
+def compare(results, baseline, threshold):
+    '''
+    Prints how every result compares to the baseline, returns the names of the ones slower by more than threshold
+    '''
+    old = {(result["name"], result["size"]): result for result in baseline["results"]}
+    slower = []
+    for result in results:
+        key = (result["name"], result["size"])
+        if key not in old:
+            continue
+        ratio = result["seconds"] / old[key]["seconds"]
+        print("{:<22} {:>10} {:8.3f}s vs {:8.3f}s ({:+.0%})".format(
+            result["name"], result["size"], result["seconds"],
+            old[key]["seconds"], ratio - 1))
+        if ratio > 1 + threshold:
+            slower.append(result["name"] + " " + result["size"])
+    return slower
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the gridworld solvers")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[20, 100],
+                        help="side lengths of the square grids to generate")
+    parser.add_argument("--boulder-density", type=float, default=0.1)
+    parser.add_argument("--terminals", type=int, default=4)
+    parser.add_argument("--noise", type=float, default=0.2)
+    parser.add_argument("--discount", type=float, default=0.9)
+    parser.add_argument("--sweeps", type=int, default=10,
+                        help="value iteration sweeps per benchmark")
+    parser.add_argument("--steps", type=int, default=20000,
+                        help="Q learning steps per benchmark (ten times as many for the batched version)")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare against the results in this JSON file")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="fraction a benchmark may be slower than the baseline before it fails")
+    parser.add_argument("--skip-memory", action="store_true",
+                        help="don't measure peak memory, halves the run time")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for side in args.sizes:
+            grid_file = os.path.join(directory, "grid_" + str(side) + ".txt")
+            generate_grid(grid_file, side, side, args.boulder_density,
+                          args.terminals, args.noise, args.discount)
+            results += run_benchmarks(grid_file, str(side) + "x" + str(side),
+                                      args.sweeps, args.steps, not args.skip_memory)
+    for result in results:
+        rates = ", ".join("{} {:.0f}".format(key, value)
+                          for key, value in result.items()
+                          if key.endswith("_per_second") and value)
+        memory = ""
+        if result["peak_memory"] is not None:
+            memory = "peak {:8.1f}MB".format(result["peak_memory"] / 1e6)
+        print("{:<22} {:>10} {:8.3f}s {} {}".format(
+            result["name"], result["size"], result["seconds"], memory, rates))
+
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": vars(args),
+        "results": results,
+    }
+    if args.output is not None:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    if args.baseline is not None:
+        with open(args.baseline, "r") as file:
+            baseline = json.load(file)
+        slower = compare(results, baseline, args.threshold)
+        if slower:
+            print("Slower than baseline: " + ", ".join(slower))
+            sys.exit(1)
@@ -0,0 +1,74 @@
+"""
+block_random.py
+A random source for the Q learning hot loop. Numbers are drawn from the generator in large blocks and handed out
+from a buffer, so every noise decision or tie break is a cheap buffer read instead of a full call into random.
+Set it as a GridWorld's rng to use it.
+"""
+
+import random
+from operator import length_hint
+from itertools import chain, repeat
+
+
+class BlockRandom:
+    '''
+    Serves random floats in [0, 1) from pregenerated blocks. Has the random(), uniform(), choice() and randint()
+    functions GridWorld and q_value_learning use from the random module.
+    '''
+
+    # seed: seeds the underlying generator, if None it is seeded from the random module so that
+    # random.seed() keeps runs reproducible
+    # block_size: how many numbers are generated at a time
+    def __init__(self, seed=None, block_size=65536):
+        if seed is None:
+            seed = random.getrandbits(64)
+        self.generator = random.Random(seed)
+        self.block_size = block_size
+        self._start()
+
+    # starts handing out numbers from the generator's current state
+    def _start(self):
+        # the generator state the current block was made from and an iterator over the block, None before
+        # the first block
+        self.block_state = None
+        self.block = None
+        # returns the next float in [0, 1). This is the buffer iterator's own __next__, so reading a number
+        # never runs any python code, only refilling a block does
+        self.random = chain.from_iterable(self._blocks()).__next__
+
+    # generates blocks of numbers forever
+    def _blocks(self):
+        generate = self.generator.random
+        while True:
+            self.block_state = self.generator.getstate()
+            self.block = iter([generate() for _ in repeat(None, self.block_size)])
+            yield self.block
+
+    # returns the state of the source (block size, generator state and how many numbers of the current block
+    # were used), setstate on a BlockRandom continues with the same numbers from there
+    def getstate(self):
+        if self.block is None:
+            return self.block_size, self.generator.getstate(), 0
+        return self.block_size, self.block_state, self.block_size - length_hint(self.block)
+
+    # restores a state from getstate
+    def setstate(self, state):
+        self.block_size, generator_state, used = state
+        self.generator.setstate(generator_state)
+        self._start()
+        for _ in repeat(None, used):
+            self.random()
+
+    # returns a float between a and b
+    def uniform(self, a, b):
+        return a + (b - a) * self.random()
+
+    # returns a random element of a non empty sequence, a sequence of one element doesn't use up a number
+    def choice(self, seq):
+        if len(seq) == 1:
+            return seq[0]
+        return seq[int(self.random() * len(seq))]
+
+    # returns a random integer between a and b, both included
+    def randint(self, a, b):
+        return a + int(self.random() * (b - a + 1))
@@ -0,0 +1,98 @@
+"""
+checkpoint.py
+Saves and restores the solver state of a GridWorld (values, known values, q values, agent position, the
+random state and the state of its BlockRandom if it uses one) to a compact binary file. The file is a fixed size header followed by the raw float64 arrays of the
+grid's GridStore, so it is memory mapped back in and copied straight into the store without any parsing.
+Arrays are in native byte order.
+"""
+
+import mmap
+from array import array
+import random
+import struct
+from grid_world import GridWorld
+from block_random import BlockRandom
+
+MAGIC = b'GWCK'
+VERSION = 2
+# magic, version, width, height, grid crc, steps, agent x, agent y, random version, has gauss, gauss next,
+# then whether the grid world uses a BlockRandom and its block size, numbers used from the current block and
+# the random version, has gauss and gauss next of its generator
+HEADER = struct.Struct('=4sIIIIQiiI?7xd?3xIQI?7xd')
+# random.getstate() holds 624 words of mersenne twister state plus the position in them
+RANDOM_STATE_WORDS = 625
+# the state of a grid world without a BlockRandom
+NO_BLOCK_STATE = (0, (0, (), None), 0)
+
+
+def save_checkpoint(path: str, grid_world: GridWorld, steps: int, grid_crc=0,
+                    random_state=None):
+    '''
+    Writes the state of a grid world to a checkpoint file.
+    steps is the number of sweeps or episodes that produced this state, grid_crc identifies the grid file
+    and random_state defaults to the current state of the random module
+    '''
+    if random_state is None:
+        random_state = random.getstate()
+    random_version, words, gauss_next = random_state
+    has_block = isinstance(grid_world.rng, BlockRandom)
+    block_size, (block_version, block_words, block_gauss), used = (
+        grid_world.rng.getstate() if has_block else NO_BLOCK_STATE)
+    store = grid_world.grid
+    with open(path, "wb") as file:
+        file.write(HEADER.pack(MAGIC, VERSION, grid_world.width, grid_world.height,
+                               grid_crc, steps, grid_world.agent_x, grid_world.agent_y,
+                               random_version, gauss_next is not None,
+                               gauss_next or 0.0, has_block, block_size, used, block_version,
+                               block_gauss is not None, block_gauss or 0.0))
+        store.values.tofile(file)
+        store.known_values.tofile(file)
+        store.q_values.tofile(file)
+        array('I', words).tofile(file)
+        array('I', block_words).tofile(file)
+
+
+def load_checkpoint(path: str, grid_world: GridWorld, grid_crc=None):
+    '''
+    Restores a checkpoint file into a grid world built from the same grid. If the checkpoint was saved from a
+    grid world with a BlockRandom the grid world gets a BlockRandom that continues where that one stopped.
+    Returns a tuple of (steps, random state), pass the random state to random.setstate to continue the run.
+    Raises ValueError if the file is not a checkpoint of this grid.
+    '''
+    with open(path, "rb") as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if len(data) < HEADER.size:
+                raise ValueError("Not a checkpoint file: " + path)
+            (magic, version, width, height, crc, steps, agent_x, agent_y,
+             random_version, has_gauss, gauss_next, has_block, block_size, used, block_version,
+             block_has_gauss, block_gauss) = HEADER.unpack_from(data)
+            if magic != MAGIC or version != VERSION:
+                raise ValueError("Not a checkpoint file: " + path)
+            if width != grid_world.width or height != grid_world.height:
+                raise ValueError("Checkpoint is for a " + str(width) + "x" +
+                                 str(height) + " grid")
+            if grid_crc is not None and crc != grid_crc:
+                raise ValueError("Checkpoint is for a different grid")
+            size = width * height
+            arrays_end = HEADER.size + size * 6 * 8
+            words_end = arrays_end + RANDOM_STATE_WORDS * 4
+            if len(data) != words_end + (RANDOM_STATE_WORDS * 4 if has_block else 0):
+                raise ValueError("Checkpoint file is truncated: " + path)
+            with memoryview(data) as view, \
+                    view[HEADER.size:arrays_end].cast('d') as doubles, \
+                    view[arrays_end:words_end].cast('I') as words, \
+                    view[words_end:].cast('I') as block_words:
+                store = grid_world.grid
+                memoryview(store.values)[:] = doubles[:size]
+                memoryview(store.known_values)[:] = doubles[size:2 * size]
+                memoryview(store.q_values)[:] = doubles[2 * size:]
+                store.values_changed()
+                random_state = (random_version, tuple(words),
+                                gauss_next if has_gauss else None)
+                if has_block:
+                    # seeded with anything, setstate replaces the generator state
+                    grid_world.rng = BlockRandom(0, block_size)
+                    grid_world.rng.setstate((block_size, (block_version, tuple(block_words),
+                                                          block_gauss if block_has_gauss else None), used))
+    grid_world.set_position(agent_x, agent_y)
+    return steps, random_state
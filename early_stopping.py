@@ -0,0 +1,113 @@
+"""
+early_stopping.py
+Q learning that stops once it has learned enough, instead of running for a hand picked number of steps. The grid is
+solved with value iteration first, which gives the true q value of every action in every cell. Every check_every
+episodes the greedy policy of the q table (q_value_learning.get_best_choices) is compared with it: the gap of a
+cell is how much worse the worst of its greedy actions is than the best action, by the true q values. Learning
+stops as soon as the largest gap is at most gap (0 means the policies agree everywhere, ties in the value iteration
+policy count as agreeing).
+"""
+
+from array import array
+from grid_world import GridWorld
+from grid_store import GridStore, EMPTY
+from instrumentation import Timer
+import valueiteration
+import q_value_learning
+
+# NumPy is optional, without it the reference is solved with the plain python value iteration
+try:
+    import array_valueiteration
+except ImportError:
+    array_valueiteration = None
+
+
+def _copy_world(grid_world: GridWorld) -> GridWorld:
+    '''
+    Returns a grid world with the same cells and settings but its own values, so it can be solved without touching
+    the original
+    '''
+    store = GridStore(grid_world.width, grid_world.height)
+    store.cell_types = array('B', grid_world.grid.cell_types)
+    store.rewards = array('d', grid_world.grid.rewards)
+    store.values = array('d', grid_world.grid.values)
+    return GridWorld(store, grid_world.start_x, grid_world.start_y, grid_world.noise,
+                     grid_world.transition_cost, grid_world.discount)
+
+
+class Reference:
+    '''
+    The value iteration solution of a grid world: the true q value of every action in every cell (indexed like
+    GridStore.q_values) and the best of them per cell, for the empty cells the agent can move out of
+    '''
+
+    def __init__(self, grid_world: GridWorld, tolerance=1e-9, max_sweeps=100000):
+        world = _copy_world(grid_world)
+        if array_valueiteration is not None:
+            array_valueiteration.iterate(world, max_sweeps, tolerance)
+        else:
+            valueiteration.iterate(world, max_sweeps, tolerance)
+        size = world.width * world.height
+        self.q_values = array('d', bytes(8 * 4 * size))
+        self.best = array('d', bytes(8 * size))
+        # the cells that are compared
+        self.states = array('i')
+        for state in range(size):
+            if world.grid.cell_types[state] != EMPTY:
+                continue
+            moves = [action for action in world.agent_actions if world.can_move_from(state, action)]
+            if not moves:
+                continue
+            for action in world.agent_actions:
+                self.q_values[state * 4 + action.value] = world.get_state_action_reward(state, action)
+            self.states.append(state)
+            self.best[state] = max(self.q_values[state * 4 + action.value] for action in moves)
+
+    # returns the largest gap between the true q value of the best action and of a greedy action of
+    # the grid world's q table over all compared cells, and how many cells have no gap
+    def gap(self, grid_world: GridWorld):
+        q_values = grid_world.grid.q_values
+        largest = 0.0
+        agreeing = 0
+        for state in self.states:
+            learned = q_values[state * 4:state * 4 + 4]
+            best_learned = max(learned)
+            cell_gap = max(self.best[state] - self.q_values[state * 4 + offset]
+                           for offset in range(4) if learned[offset] == best_learned)
+            if cell_gap <= 0:
+                agreeing += 1
+            elif cell_gap > largest:
+                largest = cell_gap
+        return largest, agreeing
+
+
+# Does Q learning on a grid world until its greedy policy is within gap of the value iteration policy.
+# reference: Reference of the grid world, solved here if not given
+# max_steps: the most steps to learn for if the policies never get close enough
+# check_every: number of episodes between comparisons, the policy is also checked before learning
+# recorder: optional instrumentation.Recorder, gets a record per check and a summary
+# the other keyword arguments are passed on to q_value_learning.iterate (replay, exploration, ...)
+# returns a tuple of (steps taken, episodes done, whether the policy got within gap, largest gap at the end)
+def learn(grid_world: GridWorld, max_steps: int, alpha: float, reference=None, check_every=100, gap=0.0,
+          recorder=None, **learning):
+    timer = Timer()
+    if reference is None:
+        reference = Reference(grid_world)
+    steps = 0
+    episodes = 0
+    while True:
+        largest, agreeing = reference.gap(grid_world)
+        converged = largest <= gap
+        if recorder is not None:
+            recorder.record("check", solver="early_stopping", steps=steps, episodes=episodes, gap=largest,
+                            agreeing=agreeing, cells=len(reference.states), seconds=timer.lap())
+        if converged or steps >= max_steps:
+            break
+        taken, done = q_value_learning.iterate(grid_world, max_steps - steps, alpha,
+                                               max_episodes=check_every, **learning)
+        steps += taken
+        episodes += done
+    if recorder is not None:
+        recorder.record("solve", solver="early_stopping", steps=steps, episodes=episodes,
+                        converged=converged, gap=largest, seconds=timer.total())
+    return steps, episodes, converged, largest
@@ -0,0 +1,76 @@
+"""
+experience_replay.py
+Experience replay for Q learning. q_value_learning.iterate normally uses every transition for one update and forgets
+it, so the value of an exit creeps back towards the start one visit at a time. With a ReplayBuffer the transitions
+are also kept in a fixed size ring buffer and after every step a batch of them, picked at random, is updated again
+with the current known values, so what the agent learns near an exit spreads without walking there again.
+
+The buffer is a set of preallocated flat arrays like GridStore, adding a transition never allocates.
+"""
+
+from array import array
+from itertools import repeat
+from grid_world import GridWorld
+
+
+class ReplayBuffer:
+    '''
+    Ring buffer of the last capacity transitions (state, action, reward, next state). States are indexed like
+    GridStore, action is action.value (its offset into the state's q values) and reward is the reward of the step
+    itself, without the discounted value of the next state, which is looked up again on every replay
+    '''
+
+    def __init__(self, capacity=10000, batch_size=32):
+        if capacity < 1:
+            raise ValueError("Replay buffer capacity must be at least 1")
+        self.capacity = capacity
+        # how many transitions are replayed after every step
+        self.batch_size = batch_size
+        self.states = array('i', bytes(4 * capacity))
+        self.actions = array('B', bytes(capacity))
+        self.rewards = array('d', bytes(8 * capacity))
+        self.next_states = array('i', bytes(4 * capacity))
+        # number of transitions stored and where the next one goes
+        self.size = 0
+        self.position = 0
+
+    def __len__(self):
+        return self.size
+
+    # stores a transition, overwriting the oldest one once the buffer is full
+    def add(self, state, action, reward, next_state):
+        position = self.position
+        self.states[position] = state
+        self.actions[position] = action
+        self.rewards[position] = reward
+        self.next_states[position] = next_state
+        position += 1
+        self.position = 0 if position == self.capacity else position
+        if self.size < self.capacity:
+            self.size += 1
+
+    # returns the indexes of n transitions picked at random (with repeats) with rng's random()
+    def sample(self, n, rng):
+        random = rng.random
+        size = self.size
+        return [int(random() * size) for _ in repeat(None, n)]
+
+    # does a TD update of batch_size random transitions on the grid world's q values, same update as
+    # q_value_learning.update with the reward worked out from the current known value of the next state.
+    # The transitions are picked with the grid world's random source
+    def replay(self, grid_world: GridWorld, alpha: float):
+        if not self.size:
+            return
+        store = grid_world.grid
+        q_values = store.q_values
+        known_values = store.known_values
+        discount = grid_world.discount
+        states, actions, rewards, next_states = self.states, self.actions, self.rewards, self.next_states
+        for i in self.sample(self.batch_size, grid_world.rng):
+            state = states[i]
+            base = state * 4
+            q = base + actions[i]
+            reward = rewards[i]
+            reward += known_values[next_states[i]] * discount
+            q_values[q] = q_values[q] * (1 - alpha) + alpha * (reward)
+            known_values[state] = max(q_values[base:base + 4])
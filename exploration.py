@@ -0,0 +1,190 @@
+"""
+exploration.py
+Exploration and learning rate schedules for q_value_learning.iterate. By default the agent always takes the greedy
+action with a fixed alpha, so it only ever learns about the cells on its current best path and a query needs a huge
+number of episodes before the rest of the grid looks reasonable. An exploration schedule makes the agent try other
+actions (epsilon greedy or softmax over the q values, decaying after every episode) and an alpha schedule lowers
+the learning rate as learning goes on (per episode or per visit of each q state), so the q values settle instead of
+jumping around with every noisy step.
+
+Schedules are given as short specs, see parse_exploration and parse_alpha_schedule.
+"""
+
+import math
+from array import array
+from grid_world import GridWorld
+from grid_store import Q_ACTIONS
+import q_value_learning
+
+
+class Greedy:
+    '''
+    Always takes the best action, ties broken randomly (q_value_learning.get_policy)
+    '''
+
+    def choose(self, grid_world: GridWorld, x, y):
+        return q_value_learning.get_policy(grid_world, x, y)
+
+    def end_episode(self):
+        pass
+
+
+class EpsilonGreedy:
+    '''
+    Takes a random action with probability epsilon and the best action otherwise. After every episode epsilon is
+    multiplied by decay, down to minimum
+    '''
+
+    def __init__(self, epsilon: float, decay=1.0, minimum=0.0):
+        self.epsilon = epsilon
+        self.decay = decay
+        self.minimum = minimum
+
+    def choose(self, grid_world: GridWorld, x, y):
+        if grid_world.rng.random() < self.epsilon:
+            return grid_world.rng.choice(Q_ACTIONS)
+        return q_value_learning.get_policy(grid_world, x, y)
+
+    def end_episode(self):
+        self.epsilon = max(self.minimum, self.epsilon * self.decay)
+
+
+class Softmax:
+    '''
+    Picks action a with probability proportional to exp(q(a) / temperature), so better actions are tried more often
+    but none is ruled out. After every episode the temperature is multiplied by decay, down to minimum
+    '''
+
+    def __init__(self, temperature: float, decay=1.0, minimum=0.01):
+        if temperature <= 0 or minimum <= 0:
+            raise ValueError("Softmax temperature must be above 0")
+        self.temperature = temperature
+        self.decay = decay
+        self.minimum = minimum
+
+    def choose(self, grid_world: GridWorld, x, y):
+        base = grid_world.state_index(x, y) * 4
+        q_values = grid_world.grid.q_values[base:base + 4]
+        # shifted by the best value so exp never overflows
+        best = max(q_values)
+        weights = [math.exp((value - best) / self.temperature) for value in q_values]
+        pick = grid_world.rng.random() * sum(weights)
+        for action, weight in zip(Q_ACTIONS, weights):
+            pick -= weight
+            if pick < 0:
+                return action
+        return Q_ACTIONS[-1]
+
+    def end_episode(self):
+        self.temperature = max(self.minimum, self.temperature * self.decay)
+
+
+class ConstantAlpha:
+    '''
+    The same alpha for every update
+    '''
+
+    def __init__(self, alpha: float):
+        self.value = alpha
+
+    def alpha(self, grid_world: GridWorld, state, action):
+        return self.value
+
+    def end_episode(self):
+        pass
+
+
+class DecayingAlpha:
+    '''
+    Alpha multiplied by decay after every episode, down to minimum
+    '''
+
+    def __init__(self, alpha: float, decay: float, minimum=0.01):
+        self.value = alpha
+        self.decay = decay
+        self.minimum = minimum
+
+    def alpha(self, grid_world: GridWorld, state, action):
+        return self.value
+
+    def end_episode(self):
+        self.value = max(self.minimum, self.value * self.decay)
+
+
+class VisitAlpha:
+    '''
+    Alpha for the n-th update of a q state is alpha / n ** power (never above alpha), so q states the agent
+    visits a lot settle down while rarely visited ones still learn quickly. power between 0.5 and 1 converges
+    '''
+
+    def __init__(self, alpha: float, power=0.8):
+        self.value = alpha
+        self.power = power
+        # number of updates of every q state, indexed like GridStore.q_values. Made on the first update
+        self.visits = None
+
+    def alpha(self, grid_world: GridWorld, state, action):
+        if self.visits is None:
+            self.visits = array('I', bytes(4 * 4 * grid_world.width * grid_world.height))
+        q = state * 4 + action.value
+        self.visits[q] += 1
+        return self.value / self.visits[q] ** self.power
+
+    def end_episode(self):
+        pass
+
+
+def _spec_numbers(spec: str, name: str, count: int):
+    '''
+    Splits a spec like epsilon:0.5:0.99 into its numbers, at most count of them
+    '''
+    numbers = spec.split(":")[1:]
+    if len(numbers) > count:
+        raise ValueError(name + " takes at most " + str(count) + " numbers: " + spec)
+    try:
+        return [float(number) for number in numbers]
+    except ValueError:
+        raise ValueError("Bad number in " + spec)
+
+
+def parse_exploration(spec: str):
+    '''
+    Makes an exploration schedule from a spec:
+    greedy, epsilon:EPSILON[:DECAY[:MINIMUM]] or softmax:TEMPERATURE[:DECAY[:MINIMUM]].
+    Raises ValueError for a bad spec
+    '''
+    name = spec.split(":")[0]
+    if name == "greedy":
+        _spec_numbers(spec, name, 0)
+        return Greedy()
+    if name == "epsilon":
+        numbers = _spec_numbers(spec, name, 3)
+        if not numbers:
+            raise ValueError("epsilon needs a value, e.g. epsilon:0.1")
+        return EpsilonGreedy(*numbers)
+    if name == "softmax":
+        numbers = _spec_numbers(spec, name, 3)
+        if not numbers:
+            raise ValueError("softmax needs a temperature, e.g. softmax:1")
+        return Softmax(*numbers)
+    raise ValueError("Unknown exploration: " + spec)
+
+
+def parse_alpha_schedule(spec: str, alpha: float):
+    '''
+    Makes an alpha schedule starting from alpha from a spec:
+    constant, decay:DECAY[:MINIMUM] or visits[:POWER].
+    Raises ValueError for a bad spec
+    '''
+    name = spec.split(":")[0]
+    if name == "constant":
+        _spec_numbers(spec, name, 0)
+        return ConstantAlpha(alpha)
+    if name == "decay":
+        numbers = _spec_numbers(spec, name, 2)
+        if not numbers:
+            raise ValueError("decay needs a rate, e.g. decay:0.99")
+        return DecayingAlpha(alpha, *numbers)
+    if name == "visits":
+        return VisitAlpha(alpha, *_spec_numbers(spec, name, 1))
+    raise ValueError("Unknown alpha schedule: " + spec)
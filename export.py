@@ -0,0 +1,169 @@
+"""
+export.py
+Writes the result of a solve in a machine readable format instead of the box art the printers draw:
+JSON lines, CSV or a compact binary file. The grid is written one row at a time (policies are worked out per row
+too), so exporting a grid with millions of cells never builds the whole thing in memory.
+
+Every format has the cell type, the value (the known value for RL), the policy and for RL the four q values
+(UP, DOWN, LEFT, RIGHT) of each cell. The policy is every best action of a cell: one action for MDP and PI,
+all tied actions for RL, none for exits, boulders and cells the agent can't leave. y=0 is the top row.
+"""
+
+import csv
+import json
+import struct
+from array import array
+from grid_world import GridWorld
+from grid_store import EMPTY, EXIT, BOULDER, Q_ACTIONS
+import rendering
+
+CELL_TYPES = {EMPTY: "empty", EXIT: "exit", BOULDER: "boulder"}
+
+BINARY_MAGIC = b'GWEX'
+BINARY_VERSION = 1
+# magic, version, x and y of the first cell, width, height, step, has q values
+BINARY_HEADER = struct.Struct('=4sIIIIIQ?7x')
+
+
+def _rows(grid_world: GridWorld, learned: bool, window=None):
+    '''
+    Yields (y, columns, values, policy masks) for every row of the window. values is a slice of the values
+    (known values if learned) and policy masks has a bit (1 << action.value) set for each best action
+    '''
+    columns, rows = rendering.window_ranges(grid_world, window)
+    store = grid_world.grid
+    values = store.known_values if learned else store.values
+    for y in rows:
+        start = y * grid_world.width
+        row = range(y, y + 1)
+        masks = array('B', bytes(len(columns)))
+        if learned:
+            for state, actions in rendering.q_policy_table(grid_world, columns, row).items():
+                for action in actions:
+                    masks[state - start - columns.start] |= 1 << action.value
+        else:
+            for state, action in rendering.policy_table(grid_world, columns, row).items():
+                if action is not None:
+                    masks[state - start - columns.start] |= 1 << action.value
+        yield y, columns, values[start + columns.start:start + columns.stop], masks
+
+
+def _policy_names(mask):
+    return [action.name for action in Q_ACTIONS if mask >> action.value & 1]
+
+
+def write_jsonl(file, grid_world: GridWorld, method: str, step: int, window=None):
+    '''
+    Writes a header line with the grid size, method and step, then one line per row of the grid
+    '''
+    learned = method == "RL"
+    columns, rows = rendering.window_ranges(grid_world, window)
+    file.write(json.dumps({"method": method, "step": step, "x": columns.start, "y": rows.start,
+                           "width": len(columns), "height": len(rows)}) + "\n")
+    store = grid_world.grid
+    for y, columns, values, masks in _rows(grid_world, learned, window):
+        start = y * grid_world.width
+        line = {
+            "y": y,
+            "types": [CELL_TYPES[store.cell_types[start + x]] for x in columns],
+            "values": values.tolist(),
+            "policy": [_policy_names(mask) for mask in masks],
+        }
+        if learned:
+            q_values = store.q_values[(start + columns.start) * 4:(start + columns.stop) * 4].tolist()
+            line["q_values"] = [q_values[i:i + 4] for i in range(0, len(q_values), 4)]
+        file.write(json.dumps(line) + "\n")
+
+
+def write_csv(file, grid_world: GridWorld, method: str, step: int, window=None):
+    '''
+    Writes one line per cell with a header line, the policy is the best actions joined by |
+    '''
+    learned = method == "RL"
+    writer = csv.writer(file, lineterminator="\n")
+    header = ["x", "y", "type", "value", "policy"]
+    if learned:
+        header += ["q_" + action.name.lower() for action in Q_ACTIONS]
+    writer.writerow(header)
+    store = grid_world.grid
+    for y, columns, values, masks in _rows(grid_world, learned, window):
+        start = y * grid_world.width
+        types = [CELL_TYPES[store.cell_types[start + x]] for x in columns]
+        policies = ["|".join(_policy_names(mask)) for mask in masks]
+        if learned:
+            q_values = store.q_values
+            writer.writerows(
+                [x, y, types[i], repr(values[i]), policies[i]] +
+                [repr(value) for value in q_values[(start + x) * 4:(start + x) * 4 + 4]]
+                for i, x in enumerate(columns))
+        else:
+            writer.writerows([x, y, types[i], repr(values[i]), policies[i]]
+                             for i, x in enumerate(columns))
+
+
+def write_binary(file, grid_world: GridWorld, method: str, step: int, window=None):
+    '''
+    Writes a header followed by one block per row: the cell types (uint8), the values (float64), the policy masks
+    (uint8, bit action.value set for every best action) and for RL the q values (float64, four per cell).
+    Arrays are in native byte order, see read_binary
+    '''
+    learned = method == "RL"
+    columns, rows = rendering.window_ranges(grid_world, window)
+    file.write(BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, columns.start, rows.start,
+                                  len(columns), len(rows), step, learned))
+    store = grid_world.grid
+    for y, columns, values, masks in _rows(grid_world, learned, window):
+        start = y * grid_world.width
+        file.write(memoryview(store.cell_types)[start + columns.start:start + columns.stop])
+        file.write(memoryview(values))
+        file.write(memoryview(masks))
+        if learned:
+            file.write(memoryview(store.q_values)[(start + columns.start) * 4:(start + columns.stop) * 4])
+
+
+def read_binary(path: str):
+    '''
+    Reads a file written by write_binary. Returns a dict with the header fields and the cell_types, values,
+    policy and q_values (empty unless the file has them) of every cell as flat arrays, row by row
+    '''
+    with open(path, "rb") as file:
+        header = file.read(BINARY_HEADER.size)
+        if len(header) < BINARY_HEADER.size:
+            raise ValueError("Not an export file: " + path)
+        magic, version, x, y, width, height, step, learned = BINARY_HEADER.unpack(header)
+        if magic != BINARY_MAGIC or version != BINARY_VERSION:
+            raise ValueError("Not an export file: " + path)
+        result = {"x": x, "y": y, "width": width, "height": height, "step": step,
+                  "cell_types": array('B'), "values": array('d'), "policy": array('B'),
+                  "q_values": array('d')}
+        try:
+            for _ in range(height):
+                result["cell_types"].fromfile(file, width)
+                result["values"].fromfile(file, width)
+                result["policy"].fromfile(file, width)
+                if learned:
+                    result["q_values"].fromfile(file, 4 * width)
+        except EOFError:
+            raise ValueError("Export file is truncated: " + path)
+    return result
+
+
+# the export formats by name (also used as the file extension) with their writer and whether the file is binary
+FORMATS = {
+    "jsonl": (write_jsonl, False),
+    "csv": (write_csv, False),
+    "bin": (write_binary, True),
+}
+
+
+def export(path: str, grid_world: GridWorld, file_format: str, method: str, step: int, window=None):
+    '''
+    Writes the result of a method solved for step steps to path in one of the FORMATS
+    '''
+    writer, binary = FORMATS[file_format]
+    if binary:
+        with open(path, "wb") as file:
+            writer(file, grid_world, method, step, window)
+    else:
+        with open(path, "w", newline="") as file:
+            writer(file, grid_world, method, step, window)
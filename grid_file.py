@@ -0,0 +1,299 @@
+"""
+grid_file.py
+Fast loading of grid files. The text format (see grid.txt) is parsed in fixed size chunks, so a Terminal or Boulder
+line that is megabytes long is never held, split or turned into tuples all at once: its entries are matched straight
+out of the chunk buffer into flat arrays and then written into a GridStore.
+There is also a binary format for huge maps: a fixed size header with the grid settings followed by the reward and
+cell type arrays of the GridStore, which is memory mapped and copied straight into a new store.
+
+python grid_file.py grid.txt grid.gwb converts a text grid to binary, python grid_file.py grid.gwb grid.txt back.
+"""
+
+import re
+import sys
+import mmap
+import struct
+from array import array
+from grid_store import GridStore, EXIT, BOULDER
+
+MAGIC = b'GWGR'
+VERSION = 1
+# magic, version, width, height, start x, start y (y=0 is the top row), K, episodes,
+# discount, alpha, noise, transition cost
+HEADER = struct.Struct('=4sIIIiiQQdddd')
+# how much of a text grid file is read at a time
+CHUNK_SIZE = 1 << 20
+
+# settings in the header, in order, with their type
+SETTINGS = [("K", int), ("Episodes", int), ("Discount", float), ("alpha", float),
+            ("Noise", float), ("TransitionCost", float)]
+
+# one entry of a Terminal line, 1={1,3,+10}
+ENTRY = re.compile(r'\d+=\{([^{}\n]*)\}')
+# turns Boulder entries into comma separated numbers, 1={4,4} is 1,,4,4,
+SEPARATORS = str.maketrans("{}=", ",,,")
+ENTRY_KEYS = ("Terminal", "Boulder")
+
+
+class _Entries:
+    '''
+    The entries of a Terminal or Boulder line as flat arrays
+    '''
+
+    def __init__(self, has_reward: bool):
+        self.has_reward = has_reward
+        self.xs = array('i')
+        self.ys = array('i')
+        self.rewards = array('d')
+
+    # adds the complete entries in a piece of the line
+    def add(self, text: str):
+        if self.has_reward:
+            for fields in ENTRY.findall(text):
+                x, y, reward = fields.split(",")
+                self.xs.append(int(x))
+                self.ys.append(int(y))
+                self.rewards.append(float(reward))
+            return
+        # boulders are by far the most entries, their numbers are converted all at once
+        numbers = array('i', map(int, filter(None, text.translate(SEPARATORS).split(","))))
+        if len(numbers) % 3:
+            raise ValueError("Boulder entries must look like 1={x,y}")
+        self.xs.extend(numbers[1::3])
+        self.ys.extend(numbers[2::3])
+
+
+def _parse_setting(config, line):
+    '''
+    Parses a short key=value line of a text grid file, ints and floats are converted and RobotStartState becomes
+    an (x, y) tuple. Lines that aren't settings are ignored
+    '''
+    if "=" not in line:
+        return
+    key, value = line.split("=", 1)
+    if key == "RobotStartState":
+        config[key] = tuple(map(int, value.strip("{}\n").split(",")))
+        return
+    try:
+        config[key] = int(value.strip())
+    except ValueError:
+        try:
+            config[key] = float(value.strip())
+        except ValueError:
+            pass
+
+
+def read_text_config(file, chunk_size=CHUNK_SIZE):
+    '''
+    Parses an open text grid file chunk by chunk. Returns a dict of the settings (see _parse_setting), with the
+    Terminal and Boulder lines as _Entries
+    '''
+    config = {key: _Entries(key == "Terminal") for key in ENTRY_KEYS}
+    buffer = ""
+    # the Terminal or Boulder line being parsed, None between lines
+    entries = None
+    done = False
+    while not done:
+        chunk = file.read(chunk_size)
+        done = not chunk
+        buffer += chunk
+        while buffer:
+            if entries is not None:
+                end = buffer.find("\n")
+                if end != -1:
+                    entries.add(buffer[:end])
+                    buffer = buffer[end + 1:]
+                    entries = None
+                    continue
+                if done:
+                    entries.add(buffer)
+                    buffer = ""
+                    break
+                # keep the unfinished entry at the end for the next chunk
+                position = buffer.rfind("}") + 1
+                entries.add(buffer[:position])
+                buffer = buffer[position:]
+                break
+            equals = buffer.find("=")
+            end = buffer.find("\n")
+            if equals != -1 and (end == -1 or equals < end) and buffer[:equals] in ENTRY_KEYS:
+                entries = config[buffer[:equals]]
+                buffer = buffer[equals + 1:]
+                continue
+            if end == -1:
+                if done:
+                    _parse_setting(config, buffer)
+                    buffer = ""
+                break
+            _parse_setting(config, buffer[:end + 1])
+            buffer = buffer[end + 1:]
+    return config
+
+
+def _check_entries(entries: _Entries, key: str, width: int, height: int):
+    '''
+    Raises ValueError if an entry of a Terminal or Boulder line is outside the grid
+    '''
+    xs, ys = entries.xs, entries.ys
+    if not xs or (0 <= min(xs) and max(xs) < width and 0 <= min(ys) and max(ys) < height):
+        return
+    for x, y in zip(xs, ys):
+        if not (0 <= x < width and 0 <= y < height):
+            raise ValueError(key + " entry {" + str(x) + "," + str(y) + "} is outside the " +
+                             str(width) + "x" + str(height) + " grid")
+
+
+def read_text_grid(path: str, chunk_size=CHUNK_SIZE):
+    '''
+    Reads a text grid file into a GridStore. Returns (store, settings), settings has the start state
+    (y=0 is the top row) under "Start" and the values of SETTINGS. Raises ValueError if a Terminal or Boulder
+    entry is outside the grid
+    '''
+    with open(path, "r") as file:
+        config = read_text_config(file, chunk_size)
+    width = config["Horizontal"]
+    height = config["Vertical"]
+    for key in ENTRY_KEYS:
+        _check_entries(config[key], key, width, height)
+    store = GridStore(width, height)
+    terminals = config["Terminal"]
+    for x, y, reward in zip(terminals.xs, terminals.ys, terminals.rewards):
+        store.set_exit(x, height - y - 1, reward)
+    boulders = config["Boulder"]
+    cell_types = store.cell_types
+    rewards = store.rewards
+    values = store.values
+    for x, y in zip(boulders.xs, boulders.ys):
+        state = (height - y - 1) * width + x
+        cell_types[state] = BOULDER
+        rewards[state] = 0
+        values[state] = 0
+    start_x, start_y = config["RobotStartState"]
+    settings = {key: config[key] for key, kind in SETTINGS}
+    settings["Start"] = (start_x, height - start_y - 1)
+    return store, settings
+
+
+def is_binary_grid(path: str) -> bool:
+    '''
+    Returns whether a grid file is in the binary format
+    '''
+    with open(path, "rb") as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+
+def save_binary_grid(path: str, store: GridStore, settings):
+    '''
+    Writes a GridStore and its settings (as returned by read_text_grid) to a binary grid file
+    '''
+    start_x, start_y = settings["Start"]
+    with open(path, "wb") as file:
+        file.write(HEADER.pack(MAGIC, VERSION, store.width, store.height, start_x, start_y,
+                               *(kind(settings[key]) for key, kind in SETTINGS)))
+        store.rewards.tofile(file)
+        store.cell_types.tofile(file)
+
+
+def load_binary_grid(path: str):
+    '''
+    Loads a binary grid file into a new GridStore. Returns (store, settings) like read_text_grid.
+    Raises ValueError if the file is not a binary grid, is truncated or has a cell type that doesn't exist
+    '''
+    with open(path, "rb") as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if len(data) < HEADER.size:
+                raise ValueError("Not a binary grid file: " + path)
+            magic, version, width, height, start_x, start_y, *values = HEADER.unpack_from(data)
+            if magic != MAGIC or version != VERSION:
+                raise ValueError("Not a binary grid file: " + path)
+            size = width * height
+            rewards_end = HEADER.size + 8 * size
+            if len(data) != rewards_end + size:
+                raise ValueError("Binary grid file is truncated: " + path)
+            store = GridStore(width, height)
+            with memoryview(data) as view, view[HEADER.size:rewards_end].cast('d') as rewards:
+                memoryview(store.rewards)[:] = rewards
+                memoryview(store.cell_types)[:] = view[rewards_end:]
+    if size and max(store.cell_types) > BOULDER:
+        raise ValueError("Binary grid file has an unknown cell type: " + path)
+    # exits keep their reward as their value, everything else starts at 0
+    store.values = array('d', store.rewards)
+    settings = {key: kind(value) for (key, kind), value in zip(SETTINGS, values)}
+    settings["Start"] = (start_x, start_y)
+    return store, settings
+
+
+def read_grid_size(path: str):
+    '''
+    Returns the (width, height) of a grid file in either format without reading the whole grid
+    '''
+    if is_binary_grid(path):
+        with open(path, "rb") as file:
+            header = file.read(HEADER.size)
+        if len(header) < HEADER.size:
+            raise ValueError("Not a binary grid file: " + path)
+        return HEADER.unpack(header)[2:4]
+    sizes = {}
+    with open(path, "r") as file:
+        at_line_start = True
+        while len(sizes) < 2:
+            # a bounded read, so long Terminal or Boulder lines are skipped a piece at a time
+            line = file.readline(64)
+            if not line:
+                break
+            if at_line_start and line.startswith(("Horizontal=", "Vertical=")):
+                _parse_setting(sizes, line)
+            at_line_start = line.endswith("\n")
+    if "Horizontal" not in sizes or "Vertical" not in sizes:
+        raise ValueError("Grid file has no Horizontal or Vertical size: " + path)
+    return sizes["Horizontal"], sizes["Vertical"]
+
+
+def read_grid_file(path: str):
+    '''
+    Reads a grid file in either format. Returns (store, settings) like read_text_grid
+    '''
+    if is_binary_grid(path):
+        return load_binary_grid(path)
+    return read_text_grid(path)
+
+
+def save_text_grid(path: str, store: GridStore, settings):
+    '''
+    Writes a GridStore and its settings to a text grid file, the Terminal and Boulder lines are written
+    a cell at a time
+    '''
+    width, height = store.width, store.height
+    start_x, start_y = settings["Start"]
+    with open(path, "w") as file:
+        file.write("Horizontal=" + str(width) + "\n")
+        file.write("Vertical=" + str(height) + "\n")
+        for key, cell_type in (("Terminal", EXIT), ("Boulder", BOULDER)):
+            file.write(key + "={")
+            count = 0
+            for state, kind in enumerate(store.cell_types):
+                if kind != cell_type:
+                    continue
+                count += 1
+                x, y = state % width, height - state // width - 1
+                if count > 1:
+                    file.write(",")
+                if cell_type == EXIT:
+                    file.write("{}={{{},{},{}}}".format(count, x, y, store.rewards[state]))
+                else:
+                    file.write("{}={{{},{}}}".format(count, x, y))
+            file.write("}\n")
+        file.write("RobotStartState={" + str(start_x) + "," + str(height - start_y - 1) + "}\n")
+        for key, kind in SETTINGS:
+            file.write(key + "=" + str(settings[key]) + "\n")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("usage: python grid_file.py <from> <to>, converts a text grid to binary or binary to text")
+        sys.exit(1)
+    store, settings = read_grid_file(sys.argv[1])
+    if is_binary_grid(sys.argv[1]):
+        save_text_grid(sys.argv[2], store, settings)
+    else:
+        save_binary_grid(sys.argv[2], store, settings)
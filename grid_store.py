@@ -0,0 +1,195 @@
+"""
+grid_store.py
+Structure of arrays storage for the cells of a gridworld. Instead of one GridItem object per cell, the cell types,
+rewards, values, known values and q values of every cell live in flat typed arrays indexed by state
+(state = y * width + x, y=0 is the top row), so a cell costs a few dozen bytes.
+"""
+
+from array import array
+from collections.abc import MutableMapping
+from cell import ExitCell, BoulderCell
+from action import Action
+
+EMPTY = 0
+EXIT = 1
+BOULDER = 2
+
+# the actions that have a q value, action.value is the offset into a state's block of q values
+Q_ACTIONS = [Action.UP, Action.DOWN, Action.LEFT, Action.RIGHT]
+# same offsets as a dict, looking up Action.value goes through the enum machinery which is slow in hot loops
+Q_OFFSETS = {action: action.value for action in Q_ACTIONS}
+
+
+class GridStore:
+    '''
+    Flat array storage for a grid. grid[y][x] still works and gives a view of a single cell.
+    '''
+
+    def __init__(self, width, height):
+        size = width * height
+        self.width = width
+        self.height = height
+        self.cell_types = array('B', bytes(size))
+        self.rewards = array('d', bytes(8 * size))
+        self.values = array('d', bytes(8 * size))
+        self.known_values = array('d', bytes(8 * size))
+        # four q values per state, in Q_ACTIONS order
+        self.q_values = array('d', bytes(8 * 4 * size))
+        # goes up every time values change, so anything worked out from them (like GridWorld's lookahead
+        # tables) knows to start over. Code that writes to values directly calls values_changed afterwards
+        self.version = 0
+
+    # builds a store from a [y][x] list of GridItems
+    @classmethod
+    def from_cells(cls, grid):
+        store = cls(len(grid[0]), len(grid))
+        for y, row in enumerate(grid):
+            for x, cell in enumerate(row):
+                state = store.state_index(x, y)
+                if isinstance(cell, ExitCell):
+                    store.set_exit(x, y, cell.value)
+                elif isinstance(cell, BoulderCell):
+                    store.set_boulder(x, y)
+                else:
+                    store.values[state] = cell.value
+                store.known_values[state] = cell.known_value
+                for action in Q_ACTIONS:
+                    store.q_values[state * 4 + action.value] = cell.q_values[action]
+        return store
+
+    # returns the index of the state at x, y (y=0 is top row)
+    def state_index(self, x, y):
+        return y * self.width + x
+
+    # marks the values as changed
+    def values_changed(self):
+        self.version += 1
+
+    # makes x, y an exit cell with the given reward, exits keep their reward as their value
+    def set_exit(self, x, y, reward):
+        state = self.state_index(x, y)
+        self.cell_types[state] = EXIT
+        self.rewards[state] = reward
+        self.values[state] = reward
+        self.version += 1
+
+    # makes x, y a boulder cell
+    def set_boulder(self, x, y):
+        state = self.state_index(x, y)
+        self.cell_types[state] = BOULDER
+        self.rewards[state] = 0
+        self.values[state] = 0
+        self.version += 1
+
+    # number of rows, so len(grid) keeps working
+    def __len__(self):
+        return self.height
+
+    # returns row y, so grid[y][x] keeps working
+    def __getitem__(self, y):
+        if not 0 <= y < self.height:
+            raise IndexError("row index out of range")
+        return GridRow(self, y)
+
+
+class GridRow:
+    '''
+    View of a row of a GridStore
+    '''
+
+    def __init__(self, store, y):
+        self.store = store
+        self.y = y
+
+    def __len__(self):
+        return self.store.width
+
+    def __getitem__(self, x):
+        if not 0 <= x < self.store.width:
+            raise IndexError("column index out of range")
+        return CellView(self.store, x, self.y)
+
+    def __iter__(self):
+        for x in range(self.store.width):
+            yield CellView(self.store, x, self.y)
+
+
+class CellView:
+    '''
+    View of a single cell of a GridStore, has the same attributes and update functions as a GridItem
+    '''
+
+    __slots__ = ('store', 'x', 'y', 'state')
+
+    def __init__(self, store, x, y):
+        self.store = store
+        self.x = x
+        self.y = y
+        self.state = store.state_index(x, y)
+
+    @property
+    def can_move(self):
+        return self.store.cell_types[self.state] == EMPTY
+
+    @property
+    def value(self):
+        return self.store.values[self.state]
+
+    @property
+    def known_value(self):
+        return self.store.known_values[self.state]
+
+    @property
+    def q_values(self):
+        return QValues(self.store, self.state)
+
+    # updates the value of a state, exits and boulders keep theirs
+    def update_value(self, value):
+        if value is None:
+            raise ValueError("Value cannot be None")
+        if self.store.cell_types[self.state] == EMPTY and self.store.values[self.state] != value:
+            self.store.values[self.state] = value
+            self.store.version += 1
+
+    # Updates the known value, similar to update_value but for q learning
+    def update_known_value(self, value):
+        if value is None:
+            raise ValueError("Value cannot be None")
+        self.store.known_values[self.state] = value
+
+
+class QValues(MutableMapping):
+    '''
+    Dict like view of the q values of a state, keyed by Action like GridItem.q_values
+    '''
+
+    __slots__ = ('q_values', 'base')
+
+    def __init__(self, store, state):
+        self.q_values = store.q_values
+        self.base = state * 4
+
+    def __getitem__(self, action):
+        return self.q_values[self.base + Q_OFFSETS[action]]
+
+    def __setitem__(self, action, value):
+        self.q_values[self.base + Q_OFFSETS[action]] = value
+
+    def __delitem__(self, action):
+        raise TypeError("Q values cannot be removed")
+
+    def __iter__(self):
+        return iter(Q_ACTIONS)
+
+    def __len__(self):
+        return len(Q_ACTIONS)
+
+    # keys and values are read every Q learning step, these skip the generic MutableMapping views
+    def keys(self):
+        return list(Q_ACTIONS)
+
+    def values(self):
+        return self.q_values[self.base:self.base + 4].tolist()
+
+    def items(self):
+        return list(zip(Q_ACTIONS, self.values()))
@@ -4,12 +4,23 @@ This is the GridWorld class, it contains all of the states and provides function
 """
 
 import random as rand
-from cell import ExitCell, EmptyCell, BoulderCell
+from array import array
+from grid_store import GridStore, QValues, EMPTY, EXIT, BOULDER
 from action import Action
 
+# NumPy is optional, it builds the transition table of a big grid much faster
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# entries of the cached policy table: 0 is not worked out yet, NO_ACTION is no move out of the state,
+# anything else is action.value + 1
+NO_ACTION = 5
+CACHED_ACTIONS = (None, Action.UP, Action.DOWN, Action.LEFT, Action.RIGHT, None)
 
 class GridWorld:
-    # Grid is a [y][x] array of cells. 
+    # Grid is a GridStore, or a [y][x] array of cells which gets copied into one.
     # Start_x is starting s value 
     # start_y is starting y value (indexed as 0 being top row), 
     # noise is a float, probability of wind 
@@ -17,6 +28,8 @@ class GridWorld:
     # discount is a float
     def __init__(self, grid, start_x, start_y, noise, transition_cost,
                  discount):
+        if not isinstance(grid, GridStore):
+            grid = GridStore.from_cells(grid)
         self.grid = grid
         self.start_x = start_x
         self.start_y = start_y
@@ -41,20 +54,90 @@ class GridWorld:
         self.agent_actions = [
             Action.UP, Action.DOWN, Action.LEFT, Action.RIGHT
         ]
+        self.width = grid.width
+        self.height = grid.height
+        # probabilities of the successors in every entry of the transition table
+        self.transition_probabilities = (noise / 2, noise / 2, 1 - noise)
+        self.successors = self._build_transitions()
+        # source of randomness for noise and random starts, the random module unless replaced
+        # (e.g. with a block_random.BlockRandom). Anything with random(), choice() and randint() works
+        self.rng = rand
+        # lookahead tables cached by computeActionFromValues and computeQValueFromValues, made on first use
+        # and started over when the store's values change (GridStore.version)
+        self.lookahead_version = None
+        self.policy_table = None
+        self.q_table = None
+
+    # returns the index of the state at x, y (y=0 is top row) used by the transition table
+    def state_index(self, x, y):
+        return y * self.width + x
+
+    # returns the (x, y) position of a state index
+    def state_position(self, state):
+        return (state % self.width, state // self.width)
+
+    # Builds the transition table once for the grid.
+    # For every state and action there are three successor states: the two noise successors first and
+    # the desired successor last (same order get_weighted_action_reward always used), with probabilities
+    # transition_probabilities. They are stored flat, starting at (state * 4 + action.value) * 3
+    def _build_transitions(self):
+        cell_types = self.grid.cell_types
+        width = self.width
+        # which move (by action value) goes in each of the 12 slots of a state
+        layout = [
+            move.value for action in self.agent_actions
+            for move in self.action_noises[action] + [action]
+        ]
+        if np is not None:
+            return self._build_transitions_array(layout)
+        successors = array('i', bytes(4 * 12 * width * self.height))
+        for y in range(self.height):
+            for x in range(width):
+                state = y * width + x
+                # moving into a boulder or off the grid leaves the agent where it is
+                up = state - width if y > 0 and cell_types[state - width] != BOULDER else state
+                down = state + width if y < self.height - 1 and cell_types[state + width] != BOULDER else state
+                left = state - 1 if x > 0 and cell_types[state - 1] != BOULDER else state
+                right = state + 1 if x < width - 1 and cell_types[state + 1] != BOULDER else state
+                moves = (up, down, left, right)
+                successors[state * 12:state * 12 + 12] = array('i', [moves[i] for i in layout])
+        return successors
+
+    # _build_transitions with shifted NumPy arrays of state indexes instead of a loop over the cells,
+    # gives the same table
+    def _build_transitions_array(self, layout):
+        shape = (self.height, self.width)
+        boulders = np.frombuffer(self.grid.cell_types, dtype=np.uint8).reshape(shape) == BOULDER
+        states = np.arange(self.width * self.height, dtype=np.intc).reshape(shape)
+        # moves[action value] is the state every cell moves to, staying put unless the move is possible
+        moves = np.empty((4,) + shape, dtype=np.intc)
+        moves[:] = states
+        moves[Action.UP.value, 1:, :] = np.where(boulders[:-1, :], states[1:, :], states[:-1, :])
+        moves[Action.DOWN.value, :-1, :] = np.where(boulders[1:, :], states[:-1, :], states[1:, :])
+        moves[Action.LEFT.value, :, 1:] = np.where(boulders[:, :-1], states[:, 1:], states[:, :-1])
+        moves[Action.RIGHT.value, :, :-1] = np.where(boulders[:, 1:], states[:, :-1], states[:, 1:])
+        successors = array('i')
+        successors.frombytes(np.ascontiguousarray(moves.reshape(4, -1)[layout].T).tobytes())
+        return successors
+
+    # returns the (successor state, probability) pairs of taking an action at a state
+    def get_transitions(self, state, action: Action):
+        base = (state * 4 + action.value) * 3
+        return list(zip(self.successors[base:base + 3], self.transition_probabilities))
 
     # Picks a random empty cell, this was for experimenting with random start positions
     def choose_random_empty_cell(self):
         selection = None
         while selection is None:
-            x = rand.randint(0, len(self.grid[0]) - 1)
-            y = rand.randint(0, len(self.grid) - 1)
-            if isinstance(self.grid[y][x], EmptyCell):
+            x = self.rng.randint(0, self.width - 1)
+            y = self.rng.randint(0, self.height - 1)
+            if self.is_cell(x, y):
                 selection = (x, y)
         return selection
 
     # returns whether or not the agent is currently in an end state
     def is_satisfied(self):
-        return isinstance(self.grid[self.agent_y][self.agent_x], ExitCell)
+        return self.is_exit(self.agent_x, self.agent_y)
 
     # resets the position of the agent, pass random=True for a random init
     def reset(self, random=False):
@@ -75,36 +158,43 @@ class GridWorld:
     # determines if an agent can actually move in a certain direction if it tries to. 
     # Prevents agent from leaving grid or going into boulders
     def can_move(self, action: Action):
+        cell_types = self.grid.cell_types
+        state = self.agent_y * self.width + self.agent_x
         if action == Action.UP:
-            return self.agent_y > 0 and not isinstance(
-                self.grid[self.agent_y - 1][self.agent_x], BoulderCell)
+            return self.agent_y > 0 and cell_types[state - self.width] != BOULDER
         elif action == Action.DOWN:
-            return self.agent_y < len(self.grid) - 1 and not isinstance(
-                self.grid[self.agent_y + 1][self.agent_x], BoulderCell)
+            return self.agent_y < self.height - 1 and cell_types[state + self.width] != BOULDER
         elif action == Action.LEFT:
-            return self.agent_x > 0 and not isinstance(
-                self.grid[self.agent_y][self.agent_x - 1], BoulderCell)
+            return self.agent_x > 0 and cell_types[state - 1] != BOULDER
         elif action == Action.RIGHT:
-            return self.agent_x < len(self.grid[0]) - 1 and not isinstance(
-                self.grid[self.agent_y][self.agent_x + 1], BoulderCell)
+            return self.agent_x < self.width - 1 and cell_types[state + 1] != BOULDER
 
     # perturbs and returns and action according to random noise
     def peturb_action(self, action):
-        action = rand.choice(self.action_noises[action])
+        action = self.rng.choice(self.action_noises[action])
         return action
 
-    # Gets the value of taking an action at a state wrt noise
+    # Gets the value of taking an action at the agent's state wrt noise
     def get_weighted_action_reward(self, desired_action):
-        cur_x = self.agent_x
-        cur_y = self.agent_y
+        return self.get_state_action_reward(
+            self.state_index(self.agent_x, self.agent_y), desired_action)
+
+    # Gets the value of taking an action at a state index wrt noise, reads the transition table
+    # and never moves the agent so it is safe to call from multiple threads
+    def get_state_action_reward(self, state, desired_action):
+        values = self.grid.values
+        successors = self.successors
+        base = (state * 4 + desired_action.value) * 3
         reward = 0
-        for action in self.action_noises[desired_action]:
-            reward += self.take_action(action) * self.noise / 2
-            self.set_position(cur_x, cur_y)
-        reward += self.take_action(desired_action) * (1 - self.noise)
-        self.set_position(cur_x, cur_y)
+        for i in range(3):
+            reward += (self.transition_cost + values[successors[base + i]] *
+                       self.discount) * self.transition_probabilities[i]
         return reward
 
+    # returns whether or not the desired action actually moves the agent out of a state
+    def can_move_from(self, state, action: Action):
+        return self.successors[(state * 4 + action.value) * 3 + 2] != state
+
     # takes an action, moves the agent, returns a reward
     # has_noise: should there be random perturbations (yes for q learning)
     # use_true_values: should it use true values or known values of states (False for q learning)
@@ -112,65 +202,108 @@ class GridWorld:
                     action: Action,
                     has_noise=False,
                     use_true_value=True):
-        if has_noise and rand.uniform(0, 1) <= self.noise:
+        if has_noise and self.rng.random() <= self.noise:
             action = self.peturb_action(action)
         if not self.can_move(action):
             action = Action.NOPE
         self.agent_x += self.action_to_index[action.value][0]
         self.agent_y += self.action_to_index[action.value][1]
         reward = self.transition_cost
+        state = self.agent_y * self.width + self.agent_x
         if use_true_value:
-            reward += self.grid[self.agent_y][
-                self.agent_x].value * self.discount
+            reward += self.grid.values[state] * self.discount
         else:
-            reward += self.grid[self.agent_y][self.agent_x].known_value * self.discount
+            reward += self.grid.known_values[state] * self.discount
         return reward
 
-    # Updates the true value of a state
+    # Updates the true value of a state, exits and boulders keep their value
     def update_value(self, x, y, value):
-        self.grid[y][x].update_value(value)
+        if value is None:
+            raise ValueError("Value cannot be None")
+        state = self.state_index(x, y)
+        if self.grid.cell_types[state] == EMPTY and self.grid.values[state] != value:
+            self.grid.values[state] = value
+            self.grid.values_changed()
 
     # Updates the known value of a state
     def update_known_value(self, x, y, value):
-        self.grid[y][x].update_known_value(value)
+        if value is None:
+            raise ValueError("Value cannot be None")
+        self.grid.known_values[self.state_index(x, y)] = value
+
+    # returns the true value of a state, y=0 is the top row
+    def get_value(self, x, y):
+        return self.grid.values[self.state_index(x, y)]
+
+    # returns the known (q learning) value of a state, y=0 is the top row
+    def get_known_value(self, x, y):
+        return self.grid.known_values[self.state_index(x, y)]
+
+    # makes sure the cached lookahead tables are for the current values, empties them if the values changed
+    def _check_lookahead_tables(self):
+        if self.lookahead_version != self.grid.version:
+            size = self.width * self.height
+            self.policy_table = array('B', bytes(size))
+            # nan is not worked out yet
+            self.q_table = array('d', [float('nan')]) * (4 * size)
+            self.lookahead_version = self.grid.version
+
+    # returns the Q value of an action at a state index from the values, cached until the values change
+    def _lookahead(self, index, action: Action):
+        q = index * 4 + action.value
+        reward = self.q_table[q]
+        if reward != reward:
+            reward = self.get_state_action_reward(index, action)
+            self.q_table[q] = reward
+        return reward
 
     # Requested function (this was added after we were done the assignment)
     # Given a state, finds the best action to take given true state values.
     # State is a tuple (x, y), where y=0 is the top row
+    # The answer is cached until the values change, so asking again is a table lookup
     def computeActionFromValues(self, state: tuple):
-        saved_pos = self.get_position()
+        self._check_lookahead_tables()
+        index = self.state_index(state[0], state[1])
+        cached = self.policy_table[index]
+        if cached:
+            return CACHED_ACTIONS[cached]
         best_action = None
         best_score = None
-        pos_x = state[0]
-        pos_y = state[1]
         for action in [Action.UP, Action.DOWN, Action.RIGHT, Action.LEFT]:
-            self.set_position(pos_x, pos_y)
-            if self.can_move(action):
-                cur_score = self.get_weighted_action_reward(action)
+            if self.can_move_from(index, action):
+                cur_score = self._lookahead(index, action)
                 if best_action is None or cur_score > best_score:
                     best_action = action
                     best_score = cur_score
-        self.set_position(saved_pos[0], saved_pos[1])
+        self.policy_table[index] = NO_ACTION if best_action is None else best_action.value + 1
         return best_action
 
     # Requested function (written after we were done)
     # Computes the Q value of taking an action a at state s
     # State is a tuple (x, y), where y=0 is the top row
     # action is an Action
+    # Cached like computeActionFromValues, NOPE stays in the state so it has no successors to look up
     def computeQValueFromValues(self, state: tuple, action: Action):
-        saved_pos = self.get_position()
-        pos_x = state[0]
-        pos_y = state[1]
-        self.set_position(pos_x, pos_y)
-        reward = self.get_weighted_action_reward(action)
-        self.set_position(saved_pos[0], saved_pos[1])
-        return reward
+        index = self.state_index(state[0], state[1])
+        if action == Action.NOPE:
+            return self.transition_cost + self.discount * self.grid.values[index]
+        self._check_lookahead_tables()
+        return self._lookahead(index, action)
 
     # returns whether or not a cell is Empty (can be walked on, not an exist cell)
     # y=0 is the top row
     def is_cell(self, x, y):
-        return isinstance(self.grid[y][x], EmptyCell)
+        return self.grid.cell_types[self.state_index(x, y)] == EMPTY
+
+    # returns whether or not a cell is an exit, y=0 is the top row
+    def is_exit(self, x, y):
+        return self.grid.cell_types[self.state_index(x, y)] == EXIT
+
+    # returns whether or not a cell is a boulder, y=0 is the top row
+    def is_boulder(self, x, y):
+        return self.grid.cell_types[self.state_index(x, y)] == BOULDER
 
     # gets the q values for a state, y=0 is the top row
+    # this is a view keyed by Action, writing to it updates the grid
     def get_q_values(self, x, y):
-        return self.grid[y][x].q_values
+        return QValues(self.grid, y * self.width + x)
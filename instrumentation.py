@@ -0,0 +1,58 @@
+"""
+instrumentation.py
+Optional metrics for the solvers. Pass a Recorder to a solver's iterate and it records a line per sweep,
+iteration or episode (timings, bellman residuals, episode lengths and returns) plus a summary when it finishes.
+Solvers only do the extra work when a recorder is given.
+"""
+
+import json
+import time
+
+
+class Recorder:
+    '''
+    Collects metric records as dicts. Every record gets the recorder's current context (e.g. the query being run)
+    and is either kept in records or, if a stream is given, written to it straight away as a JSON line.
+    '''
+
+    def __init__(self, stream=None):
+        self.stream = stream
+        self.records = []
+        self.context = {}
+
+    # records one event with its fields
+    def record(self, event: str, **fields):
+        record = dict(self.context, event=event, **fields)
+        if self.stream is not None:
+            self.stream.write(json.dumps(record) + "\n")
+        else:
+            self.records.append(record)
+
+    # writes records collected by other recorders (e.g. in worker processes) to this one's stream
+    def extend(self, records):
+        for record in records:
+            if self.stream is not None:
+                self.stream.write(json.dumps(record) + "\n")
+            else:
+                self.records.append(record)
+
+
+class Timer:
+    '''
+    Measures the time between laps
+    '''
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.last = self.start
+
+    # returns the seconds since the last lap (or since the timer was made)
+    def lap(self):
+        now = time.perf_counter()
+        seconds = now - self.last
+        self.last = now
+        return seconds
+
+    # returns the seconds since the timer was made
+    def total(self):
+        return time.perf_counter() - self.start
@@ -0,0 +1,128 @@
+"""
+multi_seed.py
+Runs several independent Q learning trainings of the same grid, one per seed, across worker processes and
+aggregates them: the mean and variance of every q value and how often each action was the learned policy.
+Shows how much a learned policy depends on the seed without launching reader.py over and over.
+"""
+
+import sys
+import random
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
+from grid_store import Q_ACTIONS
+import q_value_learning
+import reader
+
+
+class SeedStatistics:
+    '''
+    Per state statistics over a set of Q learning runs, states are indexed like GridStore
+    '''
+
+    def __init__(self, width, height, seeds):
+        size = width * height
+        self.width = width
+        self.height = height
+        self.seeds = seeds
+        # four entries per state in Q_ACTIONS order, like GridStore.q_values
+        self.mean = array('d', bytes(8 * 4 * size))
+        self.variance = array('d', bytes(8 * 4 * size))
+        # fraction of the runs where each action was the policy, ties split evenly between the actions
+        self.policy_frequencies = array('d', bytes(8 * 4 * size))
+
+    def _by_action(self, values, x, y):
+        base = (y * self.width + x) * 4
+        return {action: values[base + action.value] for action in Q_ACTIONS}
+
+    # returns the mean q value of every action at x, y (y=0 is the top row)
+    def get_mean(self, x, y):
+        return self._by_action(self.mean, x, y)
+
+    # returns the (population) variance of the q value of every action at x, y
+    def get_variance(self, x, y):
+        return self._by_action(self.variance, x, y)
+
+    # returns how often every action was the learned policy at x, y
+    def get_policy_frequencies(self, x, y):
+        return self._by_action(self.policy_frequencies, x, y)
+
+
+def train(grid_file_name: str, seed: int, episodes: int, alpha: float, agents=None):
+    '''
+    Trains one Q learning run with the given seed. Returns the q table and the weight of every action
+    in the learned policy, both flat in GridStore order
+    '''
+    (grid, k, eps, a) = reader.read_grid(grid_file_name)
+    random.seed(seed)
+    if agents is not None:
+        import batched_q_learning
+        batched_q_learning.iterate(grid, episodes, alpha, agents)
+    else:
+        q_value_learning.iterate(grid, episodes, alpha)
+    policy = array('d', bytes(len(grid.grid.q_values) * 8))
+    for y in range(grid.height):
+        for x in range(grid.width):
+            if grid.is_cell(x, y):
+                choices = q_value_learning.get_best_choices(grid, x, y)
+                for action in choices:
+                    policy[grid.state_index(x, y) * 4 + action.value] = 1 / len(choices)
+    return grid.grid.q_values, policy
+
+
+def run_seeds(grid_file_name: str, seeds: List[int], episodes=None, alpha=None,
+              agents=None, processes=None) -> SeedStatistics:
+    '''
+    Trains one run per seed across a pool of processes and returns their SeedStatistics.
+    episodes and alpha default to the grid file's Episodes and alpha. Raises ValueError if there are no seeds
+    '''
+    seeds = list(seeds)
+    if not seeds:
+        raise ValueError("run_seeds needs at least one seed")
+    (grid, k, eps, a) = reader.read_grid(grid_file_name)
+    episodes = eps if episodes is None else episodes
+    alpha = a if alpha is None else alpha
+    stats = SeedStatistics(grid.width, grid.height, seeds)
+    mean = stats.mean
+    # sum of squared differences from the running mean (Welford's method), divided by the count at the end
+    squares = stats.variance
+    with ProcessPoolExecutor(processes) as pool:
+        runs = [
+            pool.submit(train, grid_file_name, seed, episodes, alpha, agents)
+            for seed in seeds
+        ]
+        for count, run in enumerate(runs, 1):
+            q_values, policy = run.result()
+            for i, value in enumerate(q_values):
+                delta = value - mean[i]
+                mean[i] += delta / count
+                squares[i] += delta * (value - mean[i])
+                stats.policy_frequencies[i] += policy[i]
+    count = len(seeds)
+    for i in range(len(mean)):
+        squares[i] /= count
+        stats.policy_frequencies[i] /= count
+    return stats
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (3, 4):
+        print("Usage: python multi_seed.py <grid> <runs> [episodes]")
+        exit(1)
+    if int(sys.argv[2]) < 1:
+        print("runs must be at least 1")
+        exit(1)
+    episodes = int(sys.argv[3]) if len(sys.argv) == 4 else None
+    stats = run_seeds(sys.argv[1], range(int(sys.argv[2])), episodes)
+    (grid, k, eps, a) = reader.read_grid(sys.argv[1])
+    for y in range(grid.height):
+        for x in range(grid.width):
+            if not grid.is_cell(x, y):
+                continue
+            mean = stats.get_mean(x, y)
+            variance = stats.get_variance(x, y)
+            frequencies = stats.get_policy_frequencies(x, y)
+            print("(" + str(x) + ", " + str(y) + ") " + ", ".join(
+                "{}: {:.3f} +/- {:.3f} policy {:.0%}".format(
+                    action.name, mean[action], variance[action] ** 0.5,
+                    frequencies[action]) for action in Q_ACTIONS))
@@ -0,0 +1,165 @@
+"""
+multigrid.py
+Coarse to fine value iteration for large maps. Value iteration only moves value one cell per sweep, so on a big grid
+the states far from any exit need as many sweeps as their distance to it before they even see it. Here the grid is
+pooled into coarser and coarser grids (factor x factor blocks of cells become one cell), the coarsest grid is solved
+first and every solution is spread back onto the next finer grid as its starting values. The fine grid then only has
+to correct the details, which takes far fewer sweeps to reach the same tolerance.
+
+The coarse grids are only used as a starting point, the result is value iteration on the real grid run to tolerance.
+
+python multigrid.py grid.txt [tolerance] compares it against plain value iteration.
+"""
+
+import sys
+import time
+from grid_world import GridWorld
+from grid_store import GridStore, EMPTY, EXIT
+from instrumentation import Timer
+import valueiteration
+
+# NumPy is optional, without it every level is solved with the plain python value iteration
+try:
+    import array_valueiteration
+except ImportError:
+    array_valueiteration = None
+
+
+def coarsen(grid_world: GridWorld, factor=2) -> GridWorld:
+    '''
+    Returns a grid world with a cell for every factor x factor block of cells. A block is only a boulder if all its
+    cells are (so no passage gets closed off) and is an exit if any of its cells is, with the mean reward of its exits.
+    One coarse step stands for factor fine steps, so the discount and transition cost are compounded to match
+    '''
+    width = (grid_world.width + factor - 1) // factor
+    height = (grid_world.height + factor - 1) // factor
+    store = GridStore(width, height)
+    fine = grid_world.grid
+    exit_rewards = [0.0] * (width * height)
+    exit_counts = [0] * (width * height)
+    open_cells = [0] * (width * height)
+    for y in range(grid_world.height):
+        for x in range(grid_world.width):
+            state = y * grid_world.width + x
+            block = (y // factor) * width + x // factor
+            if fine.cell_types[state] == EXIT:
+                exit_rewards[block] += fine.rewards[state]
+                exit_counts[block] += 1
+            elif fine.cell_types[state] == EMPTY:
+                open_cells[block] += 1
+    for block in range(width * height):
+        if exit_counts[block]:
+            store.set_exit(block % width, block // width, exit_rewards[block] / exit_counts[block])
+        elif not open_cells[block]:
+            store.set_boulder(block % width, block // width)
+    discount = grid_world.discount ** factor
+    transition_cost = sum(grid_world.transition_cost * grid_world.discount ** i for i in range(factor))
+    return GridWorld(store, grid_world.start_x // factor, grid_world.start_y // factor,
+                     grid_world.noise, transition_cost, discount)
+
+
+def prolong(coarse: GridWorld, grid_world: GridWorld, factor=2):
+    '''
+    Sets the value of every empty cell of grid_world to the value of its block in the coarse grid world.
+    An empty cell in a block that became an exit is next to that exit and the blocks around it, so it gets the
+    value of the best step into one of them
+    '''
+    cell_types = grid_world.grid.cell_types
+    values = grid_world.grid.values
+    coarse_types = coarse.grid.cell_types
+    coarse_values = coarse.grid.values
+    for y in range(grid_world.height):
+        row = (y // factor) * coarse.width
+        for x in range(grid_world.width):
+            state = y * grid_world.width + x
+            if cell_types[state] != EMPTY:
+                continue
+            block = row + x // factor
+            if coarse_types[block] == EXIT:
+                best = max(coarse_values[successor] for successor in coarse.successors[block * 12:block * 12 + 12])
+                values[state] = grid_world.transition_cost + grid_world.discount * best
+            else:
+                values[state] = coarse_values[block]
+    grid_world.grid.values_changed()
+
+
+def set_trapped_values(grid_world: GridWorld):
+    '''
+    Empty cells the agent can never get out of to an exit (pockets closed off by boulders) just pay the transition
+    cost forever, sets them straight to that value. Pooling opens such pockets up on the coarse grids, so the
+    value they get from there is far off and would otherwise take the most sweeps to correct. Without discounting
+    that value has no limit, so nothing is set
+    '''
+    if grid_world.discount >= 1:
+        return
+    # flood fill from the exits, moves between neighbouring cells work both ways
+    cell_types = grid_world.grid.cell_types
+    width, height = grid_world.width, grid_world.height
+    reachable = bytearray(width * height)
+    queue = [state for state, cell_type in enumerate(cell_types) if cell_type == EXIT]
+    for state in queue:
+        reachable[state] = 1
+    while queue:
+        next_queue = []
+        for state in queue:
+            x = state % width
+            for neighbour in (state - width if state >= width else -1,
+                              state + width if state < width * (height - 1) else -1,
+                              state - 1 if x > 0 else -1,
+                              state + 1 if x < width - 1 else -1):
+                if neighbour >= 0 and not reachable[neighbour] and cell_types[neighbour] == EMPTY:
+                    reachable[neighbour] = 1
+                    next_queue.append(neighbour)
+        queue = next_queue
+    trapped = [state for state, cell_type in enumerate(cell_types) if cell_type == EMPTY and not reachable[state]]
+    if not trapped:
+        return
+    value = grid_world.transition_cost / (1 - grid_world.discount)
+    for state in trapped:
+        grid_world.grid.values[state] = value
+    grid_world.grid.values_changed()
+
+
+def _value_iterate(grid_world: GridWorld, tolerance, max_sweeps):
+    if array_valueiteration is not None:
+        return array_valueiteration.iterate(grid_world, max_sweeps, tolerance)
+    return valueiteration.iterate(grid_world, max_sweeps, tolerance)
+
+
+# Does value iteration to a tolerance starting from the solutions of coarser grids.
+# Grids are coarsened by factor while they stay at least min_size cells across, every level is solved until
+# its bellman residual drops below tolerance (or max_sweeps).
+# recorder: optional instrumentation.Recorder, gets a record per level
+# returns a tuple of (number of sweeps done on grid_world, residual of the last sweep)
+def solve(grid_world: GridWorld, tolerance=1e-6, factor=2, min_size=8, max_sweeps=100000,
+          recorder=None):
+    levels = [grid_world]
+    while min(levels[-1].width, levels[-1].height) >= factor * min_size:
+        levels.append(coarsen(levels[-1], factor))
+    sweeps, residual = 0, None
+    for level in range(len(levels) - 1, -1, -1):
+        timer = Timer()
+        if level < len(levels) - 1:
+            prolong(levels[level + 1], levels[level], factor)
+            set_trapped_values(levels[level])
+        sweeps, residual = _value_iterate(levels[level], tolerance, max_sweeps)
+        if recorder is not None:
+            recorder.record("level", solver="multigrid", level=level, width=levels[level].width,
+                            height=levels[level].height, sweeps=sweeps, residual=residual,
+                            seconds=timer.total())
+    return sweeps, residual
+
+
+if __name__ == "__main__":
+    import reader
+    if len(sys.argv) < 2:
+        print("usage: python multigrid.py <grid> [tolerance]")
+        sys.exit(1)
+    tolerance = float(sys.argv[2]) if len(sys.argv) > 2 else 1e-6
+    for name, run in [("value iteration", lambda grid: _value_iterate(grid, tolerance, 100000)),
+                      ("multigrid", lambda grid: solve(grid, tolerance))]:
+        grid = reader.read_grid(sys.argv[1])[0]
+        start = time.perf_counter()
+        sweeps, residual = run(grid)
+        print("{:<16} {:6d} fine sweeps, residual {:.2e}, {:.3f}s".format(
+            name, sweeps, residual, time.perf_counter() - start))
@@ -0,0 +1,145 @@
+"""
+parallel_valueiteration.py
+Value iteration split across worker processes for maps too big for one. The grid is cut into bands of rows (tiles
+spanning the full width, so every tile is one contiguous block of memory) and each worker sweeps its own band.
+The value arrays live in multiprocessing.shared_memory: every sweep reads one buffer and writes the other, so a
+worker's halo (the row above and below its band) is just read from the shared buffer its neighbours wrote the sweep
+before, and a barrier after each sweep makes sure all of them have. Each band is swept with
+array_valueiteration.ArrayGrid, so the values match array_valueiteration.iterate and valueiteration.iterate exactly.
+"""
+
+import os
+import multiprocessing
+from multiprocessing import shared_memory
+from threading import BrokenBarrierError
+import numpy as np
+from grid_world import GridWorld
+from array_valueiteration import ArrayGrid
+from instrumentation import Timer
+
+
+def _bands(height: int, workers: int):
+    '''
+    Splits the rows into workers bands of (nearly) the same size, returns (first row, row after the last) pairs
+    '''
+    return [(height * i // workers, height * (i + 1) // workers) for i in range(workers)]
+
+
+def _sweep_band(values_memory, cells_memory, residuals_memory, shape, band, index, workers, settings, k,
+                tolerance, barrier):
+    '''
+    Sweeps one band of rows k times or until the largest residual of all bands drops below tolerance.
+    values_memory holds the two [y][x] value buffers, residuals_memory the residual of every band for the last two
+    sweeps followed by the number of sweeps done and the last residual (written by the first worker)
+    '''
+    height, width = shape
+    first, last = band
+    # the band plus its halo rows
+    top = max(first - 1, 0)
+    bottom = min(last + 1, height)
+    buffers = np.ndarray((2, height, width), dtype=np.float64, buffer=values_memory.buf)
+    cell_types = np.ndarray(shape, dtype=np.uint8, buffer=cells_memory.buf)
+    residuals = np.ndarray(2 * workers + 2, dtype=np.float64, buffer=residuals_memory.buf)
+    band_grid = ArrayGrid.from_cells(cell_types[top:bottom], *settings)
+    sweeps = 0
+    residual = None
+    while sweeps < k:
+        values = buffers[sweeps % 2]
+        new_values = band_grid.sweep(values[top:bottom])[first - top:last - top]
+        residuals[(sweeps % 2) * workers + index] = np.max(np.abs(new_values - values[first:last]), initial=0)
+        buffers[(sweeps + 1) % 2][first:last] = new_values
+        barrier.wait()
+        residual = float(residuals[(sweeps % 2) * workers:(sweeps % 2 + 1) * workers].max())
+        sweeps += 1
+        if tolerance is not None and residual < tolerance:
+            break
+    if index == 0:
+        residuals[2 * workers] = sweeps
+        residuals[2 * workers + 1] = np.nan if residual is None else residual
+
+
+def _worker(values_memory, cells_memory, residuals_memory, *args):
+    '''
+    Runs _sweep_band in a worker process
+    '''
+    barrier = args[-1]
+    try:
+        _sweep_band(values_memory, cells_memory, residuals_memory, *args)
+    except BrokenBarrierError:
+        pass
+    except BaseException:
+        # let the other workers stop instead of waiting for this one forever
+        barrier.abort()
+        raise
+    finally:
+        values_memory.close()
+        cells_memory.close()
+        residuals_memory.close()
+
+
+def _copy_in(store, values_memory, cells_memory):
+    '''
+    Copies the values and cell types of a GridStore into shared memory
+    '''
+    size = store.width * store.height
+    buffers = np.ndarray((2, size), dtype=np.float64, buffer=values_memory.buf)
+    buffers[0] = np.frombuffer(store.values)
+    buffers[1] = buffers[0]
+    cells_memory.buf[:size] = store.cell_types
+
+
+def _copy_out(store, values_memory, residuals_memory, workers):
+    '''
+    Copies the values of the last sweep back into a GridStore, returns (sweeps done, residual of the last sweep)
+    '''
+    size = store.width * store.height
+    results = np.ndarray(2 * workers + 2, dtype=np.float64, buffer=residuals_memory.buf)
+    sweeps = int(results[2 * workers])
+    residual = None if sweeps == 0 else float(results[2 * workers + 1])
+    buffers = np.ndarray((2, size), dtype=np.float64, buffer=values_memory.buf)
+    memoryview(store.values)[:] = buffers[sweeps % 2].data
+    store.values_changed()
+    return sweeps, residual
+
+
+# Does value iteration with worker processes, accepts a GridWorld instance a number of steps k to do.
+# Drop in replacement for valueiteration.iterate, takes the same tolerance for stopping early.
+# workers: number of worker processes (one band of rows each), defaults to the number of cores
+# recorder: optional instrumentation.Recorder, gets a summary of the solve
+# returns a tuple of (number of sweeps done, residual of the last sweep)
+def iterate(grid_world: GridWorld, k: int, tolerance=None, workers=None, recorder=None):
+    timer = Timer()
+    store = grid_world.grid
+    shape = (store.height, store.width)
+    size = store.width * store.height
+    workers = max(1, min(workers or os.cpu_count(), store.height))
+    settings = (grid_world.noise, grid_world.transition_cost, grid_world.discount,
+                grid_world.action_noises, grid_world.agent_actions)
+    context = multiprocessing.get_context()
+    values_memory = shared_memory.SharedMemory(create=True, size=2 * 8 * size)
+    cells_memory = shared_memory.SharedMemory(create=True, size=size)
+    residuals_memory = shared_memory.SharedMemory(create=True, size=8 * (2 * workers + 2))
+    try:
+        _copy_in(store, values_memory, cells_memory)
+        barrier = context.Barrier(workers)
+        processes = [
+            context.Process(target=_worker,
+                            args=(values_memory, cells_memory, residuals_memory, shape, band, index,
+                                  workers, settings, k, tolerance, barrier))
+            for index, band in enumerate(_bands(store.height, workers))
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        if any(process.exitcode != 0 for process in processes):
+            raise RuntimeError("A value iteration worker failed")
+        sweeps, residual = _copy_out(store, values_memory, residuals_memory, workers)
+    finally:
+        for memory in (values_memory, cells_memory, residuals_memory):
+            memory.close()
+            memory.unlink()
+    if recorder is not None:
+        recorder.record("solve", solver="parallel_valueiteration", sweeps=sweeps, residual=residual,
+                        workers=workers, seconds=timer.total())
+    return sweeps, residual
@@ -0,0 +1,160 @@
+"""
+policyiteration.py
+Policy iteration. Every iteration evaluates the current policy exactly by solving the sparse linear system
+V = R + discount * P V built from the grid world's transition table, then improves the policy greedily, trying
+the actions in the same order as GridWorld.computeActionFromValues. Like valueiteration.iterate every action is
+considered, bumping into a wall included, so both converge to the same values. Usually takes a handful of
+iterations, even with a discount close to 1 where value iteration needs thousands of sweeps.
+
+With a discount of 1 only a policy that reaches an exit from every cell has finite values, so if the greedy policy
+of the starting values doesn't, policy iteration starts from one that walks the shortest way to an exit instead.
+A grid where some cell can never reach an exit, a positive transition cost (values without a limit) or a policy whose
+values can't be solved for raises ValueError.
+"""
+
+import warnings
+import numpy as np
+from scipy.sparse import csr_matrix, identity
+from scipy.sparse.csgraph import breadth_first_order
+from scipy.sparse.linalg import spsolve, MatrixRankWarning
+from grid_world import GridWorld
+from grid_store import EMPTY, EXIT
+from action import Action
+from instrumentation import Timer
+
+# the order computeActionFromValues tries the actions in, the first of equally good actions wins
+GREEDY_ORDER = [Action.UP, Action.DOWN, Action.RIGHT, Action.LEFT]
+
+
+class PolicyIteration:
+    '''
+    Transition structure of a grid world as arrays, plus the current policy over its empty states
+    '''
+
+    def __init__(self, grid_world: GridWorld):
+        store = grid_world.grid
+        size = store.width * store.height
+        self.noise = grid_world.noise
+        self.transition_cost = grid_world.transition_cost
+        self.discount = grid_world.discount
+        self.probabilities = grid_world.transition_probabilities
+        self.values = np.frombuffer(store.values)
+        cell_types = np.frombuffer(store.cell_types, dtype=np.uint8)
+        self.states = np.flatnonzero(cell_types == EMPTY)
+        self.exits = np.flatnonzero(cell_types == EXIT)
+        # position of each state in self.states, -1 for exits and boulders
+        self.empty_index = np.full(size, -1)
+        self.empty_index[self.states] = np.arange(len(self.states))
+        # successors[state][i][slot] for the actions in GREEDY_ORDER
+        successors = np.frombuffer(grid_world.successors, dtype=np.int32).reshape(size, 4, 3)
+        self.successors = successors[self.states][:, [action.value for action in GREEDY_ORDER], :]
+        if self.discount >= 1 and self.transition_cost > 0:
+            raise ValueError("With a discount of 1 and a positive transition cost the values have no limit")
+        self.policy = self.improve()
+        if self.discount >= 1 and not self.reaches_exits(self.policy):
+            self.policy = self.shortest_to_exits()
+
+    # Q values of every empty state for the actions in GREEDY_ORDER,
+    # same order of operations as GridWorld.get_state_action_reward
+    def q_values(self):
+        rewards = np.zeros(self.successors.shape[:2])
+        for i, probability in enumerate(self.probabilities):
+            rewards += (self.transition_cost + self.values[self.successors[:, :, i]] * self.discount) * probability
+        return rewards
+
+    # returns the greedy policy (index into GREEDY_ORDER) wrt the current values, the first best action wins.
+    # A state only switches away from its current action if the new one is better by more than rounding error,
+    # otherwise equally good actions can make the policy flip back and forth forever
+    def improve(self, current=None):
+        rewards = self.q_values()
+        policy = np.argmax(rewards, axis=1)
+        if current is not None:
+            rows = np.arange(len(policy))
+            best = rewards[rows, policy]
+            tolerance = 1e-9 * np.maximum(np.abs(best), 1)
+            keep = rewards[rows, current] >= best - tolerance
+            policy[keep] = current[keep]
+        return policy
+
+    # Returns, for every state, the state after it on a shortest path to an exit (a negative number if there is
+    # none), where moves[i] are the states empty state i can move to
+    def _next_towards_exits(self, moves):
+        size = len(self.empty_index)
+        source = size
+        # the moves backwards, plus a source node in front of every exit, searched from the source
+        rows = np.concatenate([moves.ravel(), np.full(len(self.exits), source)])
+        columns = np.concatenate([np.repeat(self.states, moves.shape[1]), self.exits])
+        graph = csr_matrix((np.ones(len(rows), dtype=np.int8), (rows, columns)), shape=(size + 1, size + 1))
+        return breadth_first_order(graph, source, directed=True, return_predecessors=True)[1]
+
+    # returns whether a policy reaches an exit from every empty state (with some probability)
+    def reaches_exits(self, policy):
+        chosen = self.successors[np.arange(len(policy)), policy]
+        moves = chosen[:, [i for i, probability in enumerate(self.probabilities) if probability > 0]]
+        return bool(np.all(self._next_towards_exits(moves)[self.states] >= 0))
+
+    # returns the policy that takes the shortest way to an exit from every empty state, ignoring noise.
+    # Raises ValueError if some state can't reach an exit at all
+    def shortest_to_exits(self):
+        desired = self.successors[:, :, 2]
+        following = self._next_towards_exits(desired)[self.states]
+        stuck = np.count_nonzero(following < 0)
+        if stuck:
+            raise ValueError(str(stuck) + " of the empty cells can't reach an exit, with a discount of 1 they have "
+                             "no finite value for policy iteration")
+        return np.argmax(desired == following[:, None], axis=1)
+
+    # solves for the values of the current policy and stores them in the grid world.
+    # Raises ValueError if they can't be solved for (a policy that never reaches an exit with a discount of 1),
+    # the grid world's values are left as they were
+    def evaluate(self):
+        count = len(self.states)
+        rows = np.arange(count)
+        chosen = self.successors[rows, self.policy]
+        matrix = None
+        constant = np.full(count, self.transition_cost, dtype=float)
+        for i, probability in enumerate(self.probabilities):
+            successor = chosen[:, i]
+            index = self.empty_index[successor]
+            to_empty = index >= 0
+            part = csr_matrix((np.full(np.count_nonzero(to_empty), probability, dtype=float),
+                               (rows[to_empty], index[to_empty])), shape=(count, count))
+            matrix = part if matrix is None else matrix + part
+            # exits keep their value, they go on the right hand side
+            constant[~to_empty] += self.discount * probability * self.values[successor[~to_empty]]
+        system = (identity(count, format='csr') - self.discount * matrix).tocsc()
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", MatrixRankWarning)
+            solution = spsolve(system, constant)
+        if not np.all(np.isfinite(solution)):
+            raise ValueError("The values of the policy can't be solved for, with a discount of 1 it has to "
+                             "reach an exit from every cell")
+        self.values[self.states] = solution
+
+
+# Does policy iteration, accepts a GridWorld instance and a maximum number of iterations k.
+# Starts from the greedy policy of the current values, so calling it again continues where it stopped.
+# Each iteration evaluates the policy and improves it, stops early once the policy is stable.
+# recorder: optional instrumentation.Recorder, gets a record per iteration and a summary
+# returns the number of iterations done
+def iterate(grid_world: GridWorld, k: int, recorder=None):
+    timer = Timer()
+    solver = PolicyIteration(grid_world)
+    iterations = 0
+    while iterations < k and len(solver.states):
+        solver.evaluate()
+        iterations += 1
+        policy = solver.improve(solver.policy)
+        stable = np.array_equal(policy, solver.policy)
+        if recorder is not None:
+            recorder.record("iteration", solver="policyiteration", iteration=iterations,
+                            changed=int(np.count_nonzero(policy != solver.policy)),
+                            seconds=timer.lap())
+        if stable:
+            break
+        solver.policy = policy
+    grid_world.grid.values_changed()
+    if recorder is not None:
+        recorder.record("solve", solver="policyiteration", iterations=iterations,
+                        seconds=timer.total())
+    return iterations
@@ -0,0 +1,131 @@
+"""
+prioritized_sweeping.py
+Prioritized sweeping solver. Instead of backing up every state each sweep it keeps a priority queue of states
+ordered by their pending bellman error, so value spreads out from the exit cells and states that would not
+change are never touched. Converges to the same fixed point as valueiteration.iterate.
+"""
+
+import sys
+import time
+import heapq
+from grid_world import GridWorld
+
+# the backup budget of solve when max_backups isn't given, per empty state
+BACKUPS_PER_STATE = 10000
+
+
+# Builds the predecessor lists from the grid world's transition table.
+# predecessors[state] is the list of empty states that can land in state after any action (with or without noise)
+def build_predecessors(grid_world: GridWorld):
+    predecessors = [[] for _ in range(grid_world.width * grid_world.height)]
+    for state in _empty_states(grid_world):
+        successors = set()
+        for action in grid_world.agent_actions:
+            for successor, probability in grid_world.get_transitions(state, action):
+                successors.add(successor)
+        for successor in successors:
+            predecessors[successor].append(state)
+    return predecessors
+
+
+# returns the state indexes of all empty cells
+def _empty_states(grid_world: GridWorld):
+    return [
+        grid_world.state_index(x, y) for y in range(grid_world.height)
+        for x in range(grid_world.width) if grid_world.is_cell(x, y)
+    ]
+
+
+# returns a bytearray marking the states that can reach an exit, following the predecessor lists back from the exits
+def _reaching_exit(grid_world: GridWorld, predecessors):
+    reaching = bytearray(grid_world.width * grid_world.height)
+    queue = [
+        grid_world.state_index(x, y) for y in range(grid_world.height)
+        for x in range(grid_world.width) if grid_world.is_exit(x, y)
+    ]
+    for state in queue:
+        reaching[state] = 1
+    while queue:
+        next_queue = []
+        for state in queue:
+            for predecessor in predecessors[state]:
+                if not reaching[predecessor]:
+                    reaching[predecessor] = 1
+                    next_queue.append(predecessor)
+        queue = next_queue
+    return reaching
+
+
+# returns the best one step lookahead value of a state
+def _backup(grid_world: GridWorld, state):
+    best_reward = None
+    for action in grid_world.agent_actions:
+        reward = grid_world.get_state_action_reward(state, action)
+        if best_reward is None or reward > best_reward:
+            best_reward = reward
+    return best_reward
+
+
+# Solves the grid world with prioritized sweeping.
+# tolerance: states whose bellman error is below this are not queued, same meaning as valueiteration.iterate's tolerance
+# max_backups: budget on the number of state value updates, BACKUPS_PER_STATE per empty state if not given
+# (values that never settle, e.g. a positive transition cost with a discount of 1, would otherwise never stop)
+# With a discount of 1 the states that can't reach an exit have no finite value, they are left as they are.
+# returns a tuple of (number of backups done, largest bellman error still pending)
+def solve(grid_world: GridWorld, tolerance=1e-6, max_backups=None):
+    predecessors = build_predecessors(grid_world)
+    states = _empty_states(grid_world)
+    if grid_world.discount >= 1:
+        reaching = _reaching_exit(grid_world, predecessors)
+        states = [state for state in states if reaching[state]]
+        predecessors = [[predecessor for predecessor in before if reaching[predecessor]]
+                        for before in predecessors]
+    if max_backups is None:
+        max_backups = BACKUPS_PER_STATE * len(states)
+    priorities = {}
+    queue = []
+    for state in states:
+        error = abs(_backup(grid_world, state) - grid_world.grid.values[state])
+        if error >= tolerance:
+            priorities[state] = error
+            queue.append((-error, state))
+    heapq.heapify(queue)
+
+    backups = 0
+    while queue and backups < max_backups:
+        error, state = heapq.heappop(queue)
+        # skip entries that were queued again with a different priority since
+        if priorities.get(state) != -error:
+            continue
+        del priorities[state]
+        grid_world.grid.values[state] = _backup(grid_world, state)
+        backups += 1
+        for predecessor in predecessors[state]:
+            error = abs(_backup(grid_world, predecessor) - grid_world.grid.values[predecessor])
+            if error >= tolerance:
+                if priorities.get(predecessor) != error:
+                    priorities[predecessor] = error
+                    heapq.heappush(queue, (-error, predecessor))
+            elif predecessor in priorities:
+                del priorities[predecessor]
+    grid_world.grid.values_changed()
+    return backups, max(priorities.values(), default=0)
+
+
+if __name__ == "__main__":
+    import reader
+    import valueiteration
+    if len(sys.argv) < 2:
+        print("usage: python prioritized_sweeping.py <grid> [tolerance]")
+        sys.exit(1)
+    tolerance = float(sys.argv[2]) if len(sys.argv) > 2 else 1e-6
+    # both as (number of backups, bellman error left)
+    def value_iteration(grid):
+        sweeps, residual = valueiteration.iterate(grid, 100000, tolerance)
+        return sweeps * len(_empty_states(grid)), residual
+    for name, run in [("value iteration", value_iteration), ("prioritized", lambda grid: solve(grid, tolerance))]:
+        grid = reader.read_grid(sys.argv[1])[0]
+        start = time.perf_counter()
+        backups, error = run(grid)
+        print("{:<16} {:9d} backups, error {:.2e}, {:.3f}s".format(
+            name, backups, error, time.perf_counter() - start))
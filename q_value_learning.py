@@ -3,11 +3,11 @@ q_value_learning.py
 
 """
 
-from cell import ExitCell
-from color import Color
+import sys
 from grid_world import GridWorld
-from action import Action
-import random as rand
+from grid_store import Q_ACTIONS, Q_OFFSETS
+from instrumentation import Timer
+import rendering
 
 PRINT_AGENT = False
 
@@ -18,192 +18,114 @@ def getQValue(grid_world, x, y):
 
 # returns the value at a state x, y
 # y=0 is the top row
+# reads the state's q values straight from the store, this and update run every Q learning step
 def getValue(grid_world, x, y):
-    q_values = getQValue(grid_world, x, y)
-    max_value = None
-    for value in q_values.values():
-        if max_value is None or value > max_value:
-            max_value = value
-    return max_value
+    base = (y * grid_world.width + x) * 4
+    return max(grid_world.grid.q_values[base:base + 4])
 
 # updates the known value of a q state with a given reward
 # y=0 is the top row
 def update(grid_world, x, y, action, reward, alpha):
-    q_values = getQValue(grid_world, x, y)
-    q_values[action] = q_values[action] * (1 - alpha) + alpha * (reward)
-    grid_world.update_known_value(x, y, getValue(grid_world, x, y))
+    store = grid_world.grid
+    q_values = store.q_values
+    state = y * grid_world.width + x
+    q = state * 4 + Q_OFFSETS[action]
+    q_values[q] = q_values[q] * (1 - alpha) + alpha * (reward)
+    store.known_values[state] = max(q_values[state * 4:state * 4 + 4])
 
 # gets the list of the best choices at a state x, y
 # it is a list so that we can randomly choose states of the same value
 # y=0 is the top row
 def get_best_choices(grid_world, x, y):
-    q_values = getQValue(grid_world, x, y)
+    base = (y * grid_world.width + x) * 4
     max_value = None
     best_choices = []
-    for action in q_values.keys():
-        action_value = q_values[action]
-        if max_value is None or q_values[action] >= max_value:
+    for action, action_value in zip(Q_ACTIONS, grid_world.grid.q_values[base:base + 4]):
+        if max_value is None or action_value >= max_value:
             if action_value == max_value:
                 best_choices.append(action)
             else:
                 best_choices = [action]
-            max_value = q_values[action]
+            max_value = action_value
     return best_choices
 
 # gets the policy at a given state x, y. Randomly chooses when states have the same value
+# using the grid world's random source
 # y=0 is the top row
 def get_policy(grid_world, x, y):
     best_choices = get_best_choices(grid_world, x, y)
-    return rand.choice(best_choices)
+    return grid_world.rng.choice(best_choices)
 
 # Does Q Value Learning, accepts a GridWorld instance, a number of episodes, and an alpha value
-def iterate(grid_world: GridWorld, eps: int, alpha: float):
+# recorder: optional instrumentation.Recorder, gets a record every time the agent reaches an exit
+# (steps taken and undiscounted return since the last exit or the start of the call) and a summary
+# replay: optional experience_replay.ReplayBuffer, every step is added to it and followed by a replayed batch
+# exploration and alpha_schedule: optional schedules from exploration.py that pick the actions and the alpha
+# of every update instead of the greedy policy and the fixed alpha
+# random_starts: start every episode after an exit from a random empty cell instead of the start state
+# max_episodes: optional, stop as soon as the agent has reached this many exits
+# returns a tuple of (number of steps taken, number of exits reached)
+def iterate(grid_world: GridWorld, eps: int, alpha: float, recorder=None, replay=None,
+            exploration=None, alpha_schedule=None, random_starts=False, max_episodes=None):
+    timer = Timer()
+    episode_start = 0
+    episodes = 0
+    taken = eps
+    step_alpha = alpha
     for i in range(eps):
-        action = get_policy(grid_world, grid_world.agent_x, grid_world.agent_y)
+        if exploration is None:
+            action = get_policy(grid_world, grid_world.agent_x, grid_world.agent_y)
+        else:
+            action = exploration.choose(grid_world, grid_world.agent_x, grid_world.agent_y)
         x, y = grid_world.get_position()
         reward = grid_world.take_action(action,
                                         has_noise=True,
                                         use_true_value=False)
-        update(grid_world, x, y, action, reward, alpha)
+        if alpha_schedule is not None:
+            step_alpha = alpha_schedule.alpha(grid_world, grid_world.state_index(x, y), action)
+        update(grid_world, x, y, action, reward, step_alpha)
+        if replay is not None:
+            replay.add(grid_world.state_index(x, y), action.value, grid_world.transition_cost,
+                       grid_world.state_index(grid_world.agent_x, grid_world.agent_y))
+            replay.replay(grid_world, step_alpha)
         if grid_world.is_satisfied():
             x, y = grid_world.get_position()
-            reward = grid_world.grid[y][x].value
+            reward = grid_world.get_value(x, y)
             grid_world.update_known_value(x, y, reward)
-            grid_world.reset(random=False)
-
-# Q value printing function for a given cell x y
-def _print_cell_value_with_arrow(grid_world, x, y, actions):
-    val = grid_world.grid[y][x].known_value
-    can_move = grid_world.grid[y][x].can_move
-    absval = abs(val)
-    if Action.LEFT in actions and can_move:
-        print('<', end='')
-    else:
-        print(' ', end='')
-    if (val == 0):
-        print(' ', end='')
-    elif val > 0:
-        print(str(Color.GREEN) + " ", end='')
-    else:
-        print(Color.RED, end='')
-    if absval >= 10:
-        print("{:2.3f}".format(val), end='')
-    elif absval >= 100:
-        print("{:3.2f}".format(val), end='')
-    elif absval >= 1000:
-        print("{:4.1f}".format(val), end='')
-    else:
-        print("{:1.4f}".format(val), end='')
-    print(Color.END, end='')
-    if Action.RIGHT in actions and can_move:
-        print('>', end='')
-    else:
-        print(' ', end='')
-
-
-def printgrid(grid_world):
-    '''
-    Prints a grid with the values and policy of each cell
-    '''
-    for y in range(len(grid_world.grid)):
-        _print_short_grid_line(grid_world)
-        for x in range(len(grid_world.grid[y])):
-            actions = get_best_choices(grid_world, x, y)
-            if Action.UP in actions and grid_world.grid[y][x].can_move:
-                print('|    ^    ', end='')
-            else:
-                print('|         ', end='')
-        print('|')
-        for x in range(len(grid_world.grid[y])):
-            actions = get_best_choices(grid_world, x, y)
-            print('|', end='')
-            if PRINT_AGENT and x == grid_world.agent_x and y == grid_world.agent_y:
-                print(Color.UNDERLINE, end='')
-            if isinstance(grid_world.grid[y][x], ExitCell):
-                _print_cell_value_with_arrow(grid_world, x, y, actions)
-            elif not grid_world.grid[y][x].can_move:
-                print('         ', end='')
-            else:
-                _print_cell_value_with_arrow(grid_world, x, y, actions)
-        print('|')
-        for x in range(len(grid_world.grid[y])):
-            actions = get_best_choices(grid_world, x, y)
-            if Action.DOWN in actions and grid_world.grid[y][x].can_move:
-                print('|    v    ', end='')
-            else:
-                print('|         ', end='')
-        print('|')
-    _print_short_grid_line(grid_world)
-
-
-def _print_value(val):
+            grid_world.reset(random=random_starts)
+            if exploration is not None:
+                exploration.end_episode()
+            if alpha_schedule is not None:
+                alpha_schedule.end_episode()
+            episodes += 1
+            if recorder is not None:
+                steps = i + 1 - episode_start
+                recorder.record("episode", solver="q_value_learning", episode=episodes,
+                                steps=steps, exit_value=reward,
+                                episode_return=steps * grid_world.transition_cost + reward,
+                                seconds=timer.lap())
+                episode_start = i + 1
+            if episodes == max_episodes:
+                taken = i + 1
+                break
+    if recorder is not None:
+        recorder.record("solve", solver="q_value_learning", steps=taken,
+                        take_action_calls=taken, episodes=episodes,
+                        replayed=0 if replay is None else taken * replay.batch_size,
+                        seconds=timer.total())
+    return taken, episodes
+
+
+def printgrid(grid_world, window=None):
     '''
-    Prints a value with a color
+    Prints a grid with the values and policy of each cell.
+    window: (x, y, width, height) of the cells to print, y=0 is the top row. None prints the whole grid
     '''
-    absval = abs(val)
-    if (val == 0):
-        print(' ', end='')
-    elif val > 0:
-        print(str(Color.GREEN) + " ", end='')
-    else:
-        print(Color.RED, end='')
-    print("{:1.2f}".format(val), end='')
-    print(Color.END, end='')
+    sys.stdout.write(rendering.q_policy_frame(grid_world, window, PRINT_AGENT))
 
 
-def _print_grid_line(grid_world):
+def printgridqvals(grid_world, window=None):
     '''
-    Prints a border of a cell in a grid
+    Prints out a the Q values for each cell, window works like in printgrid
     '''
-    for x in range(len(grid_world.grid[0])):
-        print('+-----------', end='')
-    print('+')
-
-
-def _print_short_grid_line(grid_world: GridWorld):
-    '''
-    Prints a (short) border of a cell in a grid
-    '''
-    for x in range(len(grid_world.grid[0])):
-        print("+---------", end='')
-    print('+')
-
-def printgridqvals(grid_world):
-    '''
-    Prints out a the Q values for each cell
-    '''
-    for y in range(len(grid_world.grid)):
-        _print_grid_line(grid_world)
-        for x in range(len(grid_world.grid[y])):
-            print('|   ', end='')
-            if grid_world.grid[y][x].can_move:
-                _print_value(getQValue(grid_world, x, y)[Action.UP])
-            else:
-                print('     ', end='')
-            print('   ', end='')
-        print('|')
-        for x in range(len(grid_world.grid[y])):
-            if PRINT_AGENT and x == grid_world.agent_x and y == grid_world.agent_y:
-                print(Color.UNDERLINE, end='')
-            print('|', end='')
-            if not grid_world.grid[y][x].can_move:
-                if isinstance(grid_world.grid[y][x], ExitCell):
-                    print('  ', end='')
-                    _print_value(grid_world.grid[y][x].value)
-                    print('   ', end='')
-                else:
-                    print('           ', end='')
-            else:
-                _print_value(getQValue(grid_world, x, y)[Action.LEFT])
-                print(' ', end='')
-                _print_value(getQValue(grid_world, x, y)[Action.RIGHT])
-        print('|')
-        for x in range(len(grid_world.grid[y])):
-            print('|   ', end='')
-            if grid_world.grid[y][x].can_move:
-                _print_value(getQValue(grid_world, x, y)[Action.DOWN])
-            else:
-                print('     ', end='')
-            print('   ', end='')
-        print('|')
-    _print_grid_line(grid_world)
\ No newline at end of file
+    sys.stdout.write(rendering.q_values_frame(grid_world, window, PRINT_AGENT))
\ No newline at end of file
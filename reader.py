@@ -5,135 +5,479 @@ Reads the queries from the file and runs the appropriate algorithms on the given
 """
 
 import os
+import io
 import sys
+import zlib
 import random
-from typing import Dict, List, Tuple
+import argparse
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Iterator, List, Tuple
 from grid_world import GridWorld
-from cell import EmptyCell, ExitCell, BoulderCell, GridItem
+from grid_file import read_grid_file, read_grid_size
+from rendering import clip_window
 import valueiteration
 import q_value_learning
+from checkpoint import save_checkpoint, load_checkpoint
+from block_random import BlockRandom
+from instrumentation import Recorder
+from experience_replay import ReplayBuffer
+import exploration
+import early_stopping
+import export
+
+# NumPy is optional, without it MDP queries fall back to the plain python value iteration
+# and RL queries can't use a batch of agents
+try:
+    import array_valueiteration
+    import batched_q_learning
+    import parallel_valueiteration
+except ImportError:
+    array_valueiteration = None
+    batched_q_learning = None
+    parallel_valueiteration = None
+
+# PI queries need NumPy and SciPy for the sparse linear solves
+try:
+    import policyiteration
+except ImportError:
+    policyiteration = None
+
+
+def iter_queries(file: str) -> Iterator[Tuple[int, str, str]]:
+    '''
+    Reads the queries from the file (- for stdin) one at a time, each query is yielded as soon as its line arrives.
+    Bad lines are reported on stderr and skipped
+    '''
+    stream = sys.stdin if file == "-" else open(file, "r")
+    try:
+        for line in stream:
+            if line.startswith("#") or not line.strip():
+                continue
+            try:
+                h, v, step, method, query = line.strip().split(",")
+                step = int(step)
+            except ValueError:
+                print("Skipping bad query: " + line.strip(), file=sys.stderr)
+                continue
+            yield step, method, query
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
 
 
 def read_queries(file: str) -> List[Tuple[int, str, str]]:
     '''
     Reads the queries from the file
     '''
-    queries = []
-    with open(file, "r") as file:
-        for line in file:
-            if line.startswith("#"):
-                continue
-            h, v, step, method, query = line.strip().split(",")
-            queries.append((int(step), method, query))
-    return queries
-
-
-def parse_terminal_boulder_line(line):
-    '''
-    Helper function for parsing the terminal and boulder states
-    '''
-    data = line.strip("{}\n")
-    items = data.split("},")
-    result = {}
-    for item in items:
-        key, values = item.split("={")
-        values = values.strip("}").split(",")
-        int_values = list(map(int, values[:2]))
-        if len(values) == 3:
-            int_values.append(float(values[2]))
-        result[int(key)] = tuple(int_values)
-    return result
-
-
-def read_values_from_file(file_path):
-    '''
-    Reads the config values from the grid file
-    '''
-    config = {}
-    with open(file_path, "r") as file:
-        for line in file:
-            if "=" in line:
-                key, value = line.split("=", 1)
-                if key in ["Terminal", "Boulder"]:
-                    config[key] = parse_terminal_boulder_line(value)
-                elif key == "RobotStartState":
-                    config[key] = tuple(
-                        map(int,
-                            value.strip("{}\n").split(",")))
+    return list(iter_queries(file))
+
+
+def read_grid(file: str) -> Tuple[GridWorld, int, int, int]:
+    '''
+    Reads the grid from the file, either a text grid file or a binary one (see grid_file)
+    '''
+    grid, settings = read_grid_file(file)
+    start_x, start_y = settings["Start"]
+    noise = settings["Noise"]
+    transition_cost = settings["TransitionCost"]
+    discount = settings["Discount"]
+    depth = settings["K"]
+    episodes = settings["Episodes"]
+    alpha = settings["alpha"]
+    return (GridWorld(grid, start_x, start_y, noise, transition_cost,
+                      discount), depth, episodes, alpha)
+
+
+class SolverCache:
+    '''
+    Keeps the solved GridWorld of every method so that a query for more steps continues
+    from an earlier query's solve instead of starting again from zero.
+    If a checkpoint directory is given the solves are also saved there after every query,
+    so a later run continues where this one stopped.
+    If agents is given RL queries are learned by that many agents at once (see batched_q_learning).
+    With block_random RL queries draw their noise and tie breaks from a BlockRandom seeded by seed.
+    If a recorder is given the solvers record their metrics to it (see instrumentation).
+    If vi_processes is given MDP queries are solved by that many processes at once (see parallel_valueiteration).
+    learning is a dict of options for RL queries learned by a single agent: "replay" (a (capacity, batch size)
+    pair, see experience_replay), "exploration" and "alpha_schedule" (specs, see exploration), "random_starts" and
+    "early_stop" (a (check every, gap) pair, see early_stopping: the query's step count is then the most steps
+    to learn for). The replay buffer and schedules are kept with the solve (but not in checkpoints).
+    '''
+
+    def __init__(self, grid_file_name: str, seed: int, checkpoint_dir=None,
+                 agents=None, block_random=False, recorder=None, vi_processes=None,
+                 learning=None):
+        self.grid_file_name = grid_file_name
+        self.seed = seed
+        self.checkpoint_dir = checkpoint_dir
+        self.agents = agents
+        self.block_random = block_random
+        self.recorder = recorder
+        self.vi_processes = vi_processes
+        self.learning = learning or {}
+        # q_value_learning.iterate arguments of the RL solve in solved, the buffer and schedules carry on with it
+        self.learning_state = None
+        # early_stopping.Reference of the grid, solved on the first early stopped RL query
+        self.reference = None
+        # (steps, episodes, converged, gap) of the early stopped RL solve in solved, steps and episodes
+        # count from the start of the solve (or from where it was loaded from a checkpoint)
+        self.early_stop_result = None
+        if checkpoint_dir is not None:
+            with open(grid_file_name, "rb") as file:
+                self.grid_crc = zlib.crc32(file.read())
+        # method -> (steps done, grid world, alpha, random state after the solve)
+        self.solved = {}
+
+    def _learning_state(self, alpha: float):
+        '''
+        Makes a new replay buffer and schedules from the learning options, as q_value_learning.iterate arguments
+        '''
+        learning = self.learning
+        state = {"random_starts": learning.get("random_starts", False)}
+        if learning.get("replay") is not None:
+            state["replay"] = ReplayBuffer(*learning["replay"])
+        if learning.get("exploration") is not None:
+            state["exploration"] = exploration.parse_exploration(learning["exploration"])
+        if learning.get("alpha_schedule") is not None:
+            state["alpha_schedule"] = exploration.parse_alpha_schedule(learning["alpha_schedule"], alpha)
+        return state
+
+    def _checkpoint_path(self, method: str) -> str:
+        name = os.path.basename(self.grid_file_name) + "." + method + ".ckpt"
+        return os.path.join(self.checkpoint_dir, name)
+
+    def _load(self, method: str, step: int):
+        '''
+        Loads the saved checkpoint of a method if there is one that is not past step
+        '''
+        (grid, k, eps, a) = read_grid(self.grid_file_name)
+        path = self._checkpoint_path(method)
+        if os.path.exists(path):
+            try:
+                done, state = load_checkpoint(path, grid, self.grid_crc)
+                # RL only continues a checkpoint saved with the same random source (the checkpoint gives
+                # the grid world back its BlockRandom)
+                if method == "RL" and isinstance(grid.rng, BlockRandom) != self.block_random:
+                    print("Ignoring checkpoint: it was saved " + ("without" if self.block_random else "with") +
+                          " --block-random", file=sys.stderr)
+                elif done <= step:
+                    return done, grid, a, state
+            except ValueError as e:
+                print("Ignoring checkpoint: " + str(e), file=sys.stderr)
+        return None
+
+    def solve(self, method: str, step: int) -> GridWorld:
+        '''
+        Returns the grid world solved with method for step steps (sweeps, episodes or policy iterations)
+        '''
+        saved = None
+        if method in self.solved and self.solved[method][0] <= step:
+            saved = self.solved[method]
+        elif self.checkpoint_dir is not None:
+            saved = self._load(method, step)
+        # a batch of agents can't pick up where an earlier solve stopped (their positions and generator aren't kept,
+        # and the steps are dealt out to the agents in rounds), so batched RL only reuses a solve of the same step
+        if saved is not None and method == "RL" and self.agents is not None and saved[0] != step:
+            saved = None
+        if saved is not None:
+            done, grid, a, state = saved
+            random.setstate(state)
+        else:
+            (grid, k, eps, a) = read_grid(self.grid_file_name)
+            done = 0
+            random.seed(self.seed)
+            if self.block_random:
+                grid.rng = BlockRandom()
+        recorder = self.recorder
+        if recorder is not None:
+            recorder.context = {"method": method, "step": step, "resumed_from": done}
+        if method == "MDP":
+            if self.vi_processes is not None:
+                parallel_valueiteration.iterate(grid, step - done, workers=self.vi_processes,
+                                                recorder=recorder)
+            elif array_valueiteration is not None:
+                array_valueiteration.iterate(grid, step - done, recorder=recorder)
+            else:
+                valueiteration.iterate(grid, step - done, recorder=recorder)
+        elif method == "RL":
+            if self.agents is not None:
+                batched_q_learning.iterate(grid, step - done, a, self.agents,
+                                           recorder=recorder)
+            else:
+                if self.learning_state is None or saved is not self.solved.get(method):
+                    self.learning_state = self._learning_state(a)
+                    self.early_stop_result = (0, 0, False, None)
+                early_stop = self.learning.get("early_stop")
+                if early_stop is not None:
+                    if self.reference is None:
+                        self.reference = early_stopping.Reference(grid)
+                    steps, episodes, converged, gap = early_stopping.learn(
+                        grid, step - done, a, self.reference, *early_stop, recorder=recorder,
+                        **self.learning_state)
+                    self.early_stop_result = (self.early_stop_result[0] + steps,
+                                              self.early_stop_result[1] + episodes, converged, gap)
                 else:
-                    try:
-                        config[key] = int(value.strip())
-                    except ValueError:
-                        try:
-                            config[key] = float(value.strip())
-                        except ValueError:
-                            pass
-    return config
+                    q_value_learning.iterate(grid, step - done, a, recorder=recorder,
+                                             **self.learning_state)
+        elif method == "PI":
+            policyiteration.iterate(grid, step - done, recorder=recorder)
+        self.solved[method] = (step, grid, a, random.getstate())
+        if self.checkpoint_dir is not None:
+            save_checkpoint(self._checkpoint_path(method), grid, step,
+                            self.grid_crc)
+        return grid
+
+
+def run_query(cache: SolverCache, step: int, method: str, query: str,
+              window=None, export_to=None):
+    '''
+    Runs a single query and prints its result, window is passed on to the printers.
+    export_to is a (format, directory) pair, if given the result is exported there (see export) instead of printed
+    '''
+    print("Step: " + str(step) + " Method: " + method)
+    if export_to is not None and method in ("MDP", "RL", "PI"):
+        if method == "PI" and policyiteration is None:
+            print("PI queries need NumPy and SciPy")
+            return
+        try:
+            grid = cache.solve(method, step)
+        except ValueError as e:
+            # policy iteration can't solve every grid (see policyiteration)
+            print("Can't solve: " + str(e))
+            return
+        file_format, directory = export_to
+        path = os.path.join(directory, os.path.basename(cache.grid_file_name) + "." +
+                            method + "." + str(step) + "." + file_format)
+        export.export(path, grid, file_format, method, step, window)
+        print("Exported " + path)
+    elif method == "MDP":
+        grid = cache.solve(method, step)
+        valueiteration.print_grid(grid, window)
+    elif method == "RL":
+        grid = cache.solve(method, step)
+        if cache.learning.get("early_stop") is not None:
+            steps, episodes, converged, gap = cache.early_stop_result
+            if converged and gap == 0:
+                result = "Policy matched value iteration"
+            else:
+                result = ("Policy within {:.4f} of value iteration" if converged else
+                          "Policy still {:.4f} from value iteration").format(gap)
+            print(result +
+                  " after " + str(episodes) + " episodes (" + str(steps) + " steps)")
+        if query == "bestPolicy":
+            q_value_learning.printgrid(grid, window)
+        else:
+            q_value_learning.printgridqvals(grid, window)
+    elif method == "PI":
+        if policyiteration is None:
+            print("PI queries need NumPy and SciPy")
+            return
+        try:
+            grid = cache.solve(method, step)
+        except ValueError as e:
+            print("Can't solve: " + str(e))
+            return
+        valueiteration.print_grid(grid, window)
+    else:
+        print("Unknown method: " + method)
 
 
-def build_grid(
-        horizontal: int, vertical: int, terminal: Dict[int, Tuple[int, int,
-                                                                  int]],
-        boulder: Dict[int, Tuple[int, int, int]]) -> List[List[GridItem]]:
+def run_query_group(grid_file_name: str, group: List[Tuple[int, Tuple[int, str, str]]],
+                    seed: int, checkpoint_dir=None, agents=None,
+                    block_random=False, metrics=False, window=None,
+                    export_to=None, vi_processes=None, learning=None) -> Tuple[List[Tuple[int, str]], List[dict]]:
     '''
-    Builds the grid from the config values
+    Runs a group of (index, query) pairs that share a method in order of step count, so every solve
+    continues from the previous one. Builds its own GridWorld from the grid file, so it can run in a
+    worker process. Returns the (index, output) pairs and, if metrics is set, the solvers' metric records.
     '''
-    grid = []
-    for y in range(vertical):
-        row = []
-        for x in range(horizontal):
-            row.append(EmptyCell(x, y))
-        grid.append(row)
+    recorder = Recorder() if metrics else None
+    cache = SolverCache(grid_file_name, seed, checkpoint_dir, agents,
+                        block_random, recorder, vi_processes, learning)
+    results = []
+    for i, query in sorted(group, key=lambda item: item[1][0]):
+        buffer = io.StringIO()
+        with contextlib.redirect_stdout(buffer):
+            run_query(cache, *query, window=window, export_to=export_to)
+        results.append((i, buffer.getvalue()))
+    return results, recorder.records if metrics else []
 
-    for key, value in terminal.items():
-        x, y, value = value
-        grid[vertical - y - 1][x] = ExitCell(x, vertical - y - 1, value)
 
-    for key, value in boulder.items():
-        x, y = value
-        grid[vertical - y - 1][x] = BoulderCell(x, vertical - y - 1)
-    return grid
+def run_queries(grid_file_name: str, queries: List[Tuple[int, str, str]],
+                seed: int, checkpoint_dir=None, agents=None, jobs=1,
+                block_random=False, recorder=None, window=None,
+                export_to=None, vi_processes=None, learning=None):
+    '''
+    Runs the queries grouped by method, see run_query_group. Groups don't depend on each other,
+    with jobs > 1 they are run in a pool of that many processes. A group is never split, its queries continue
+    each other's solves, so at most one process per method is busy.
+    Results are printed in the original query order, metrics go to recorder if one is given.
+    '''
+    groups = {}
+    for i, query in enumerate(queries):
+        groups.setdefault(query[1], []).append((i, query))
+    args = (seed, checkpoint_dir, agents, block_random, recorder is not None,
+            window, export_to, vi_processes, learning)
+    if jobs > 1 and len(groups) > 1:
+        with ProcessPoolExecutor(min(jobs, len(groups))) as pool:
+            futures = [
+                pool.submit(run_query_group, grid_file_name, group, *args)
+                for group in groups.values()
+            ]
+            results = [future.result() for future in futures]
+    else:
+        results = [
+            run_query_group(grid_file_name, group, *args)
+            for group in groups.values()
+        ]
+    outputs = [None] * len(queries)
+    for group_results, records in results:
+        for i, output in group_results:
+            outputs[i] = output
+        if recorder is not None:
+            recorder.extend(records)
+    for output in outputs:
+        sys.stdout.write(output)
 
 
-def read_grid(file: str) -> Tuple[GridWorld, int, int, int]:
+def run_query_stream(grid_file_name: str, queries: Iterable[Tuple[int, str, str]],
+                     seed: int, checkpoint_dir=None, agents=None,
+                     block_random=False, recorder=None, window=None,
+                     export_to=None, vi_processes=None, learning=None):
     '''
-    Reads the grid from the file
+    Runs queries in the order they arrive (e.g. from iter_queries) in this process, flushing the output of
+    each one straight away. One SolverCache is kept for the whole stream, so a query continues from the
+    previous solve of its method if that was for fewer steps, and only starts over if it was for more
     '''
-    config = read_values_from_file(file)
-    grid = build_grid(config["Horizontal"], config["Vertical"],
-                      config["Terminal"], config["Boulder"])
-    start_x, start_y = config["RobotStartState"]
-    noise = config["Noise"]
-    transition_cost = config["TransitionCost"]
-    discount = config["Discount"]
-    depth = config["K"]
-    episodes = config["Episodes"]
-    alpha = config["alpha"]
-    return (GridWorld(grid, start_x, (config["Vertical"] - 1 - start_y), noise,
-                      transition_cost, discount), depth, episodes, alpha)
+    cache = SolverCache(grid_file_name, seed, checkpoint_dir, agents,
+                        block_random, recorder, vi_processes, learning)
+    for query in queries:
+        run_query(cache, *query, window=window, export_to=export_to)
+        sys.stdout.flush()
+        if recorder is not None and recorder.stream is not None:
+            recorder.stream.flush()
 
 
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("Usage: python reader.py <grid> <queries>")
-        exit(1)
+    parser = argparse.ArgumentParser(
+        usage="python reader.py <grid> <queries> [options]")
+    parser.add_argument("grid")
+    parser.add_argument("queries", help="query file, - reads queries from stdin as they arrive")
+    parser.add_argument(
+        "--checkpoint-dir",
+        help="save solver state here after every query and continue from it on the next run")
+    parser.add_argument(
+        "--agents", type=int,
+        help="learn RL queries with this many agents at once, needs NumPy")
+    parser.add_argument(
+        "--jobs", type=int, default=1,
+        help="solve independent queries in this many processes, 0 uses every core")
+    parser.add_argument(
+        "--block-random", action="store_true",
+        help="draw RL noise and tie breaks from pregenerated blocks of random numbers")
+    parser.add_argument(
+        "--metrics", metavar="FILE",
+        help="write solver metrics (timings, residuals, episode returns) to FILE as JSON lines")
+    parser.add_argument(
+        "--window", type=int, nargs=4, metavar=("X", "Y", "WIDTH", "HEIGHT"),
+        help="only print this part of the grid, X and Y are the top left cell with Y=0 the top row")
+    parser.add_argument(
+        "--export", choices=sorted(export.FORMATS),
+        help="write each query's values, policy and q values to a file in this format instead of printing them")
+    parser.add_argument(
+        "--export-dir", default=".",
+        help="directory for --export files, default is the current directory")
+    parser.add_argument(
+        "--stream", action="store_true",
+        help="run every query as soon as it is read and print its result straight away, always on for stdin")
+    parser.add_argument(
+        "--vi-processes", type=int,
+        help="solve MDP queries with value iteration split over this many processes, 0 uses every core, needs NumPy")
+    parser.add_argument(
+        "--replay", type=int, metavar="CAPACITY",
+        help="keep the last CAPACITY RL steps in a replay buffer and replay a batch of them after every step")
+    parser.add_argument(
+        "--replay-batch", type=int, default=16,
+        help="number of steps replayed after every RL step with --replay, default 16")
+    parser.add_argument(
+        "--exploration", metavar="SPEC",
+        help="how RL agents pick actions: greedy (default), epsilon:EPSILON[:DECAY[:MINIMUM]] or "
+             "softmax:TEMPERATURE[:DECAY[:MINIMUM]], decays are per episode")
+    parser.add_argument(
+        "--alpha-schedule", metavar="SPEC",
+        help="RL learning rate: constant (default), decay:DECAY[:MINIMUM] per episode or visits[:POWER], "
+             "alpha / n ** POWER for the n-th update of a q state")
+    parser.add_argument(
+        "--early-stop", type=int, metavar="N",
+        help="stop learning RL queries once the policy matches value iteration, checked every N episodes. "
+             "The query's step count is the most steps to learn for")
+    parser.add_argument(
+        "--early-stop-gap", type=float, default=0.0,
+        help="with --early-stop, also stop once no cell's policy is more than this worse (by value "
+             "iteration's q values) than the best action, default 0")
+    parser.add_argument(
+        "--random-starts", action="store_true",
+        help="start every RL episode after the first from a random empty cell")
+    args = parser.parse_args()
+    if args.agents is not None and args.agents < 1:
+        parser.error("--agents needs at least 1 agent")
+    if args.agents is not None and batched_q_learning is None:
+        parser.error("--agents needs NumPy")
+    if args.vi_processes is not None and parallel_valueiteration is None:
+        parser.error("--vi-processes needs NumPy")
+    if args.replay is not None and args.agents is not None:
+        parser.error("--replay can't be combined with --agents")
+    if args.replay is not None and (args.replay < 1 or args.replay_batch < 0):
+        parser.error("--replay needs a capacity of at least 1 and a batch size of at least 0")
+    learning = {
+        "replay": None if args.replay is None else (args.replay, args.replay_batch),
+        "exploration": args.exploration,
+        "alpha_schedule": args.alpha_schedule,
+        "random_starts": args.random_starts,
+        "early_stop": None if args.early_stop is None else (args.early_stop, args.early_stop_gap),
+    }
+    if args.agents is not None and (args.exploration or args.alpha_schedule or args.random_starts or
+                                    args.early_stop is not None):
+        parser.error("--exploration, --alpha-schedule, --random-starts and --early-stop "
+                     "can't be combined with --agents")
+    if args.early_stop is not None and args.early_stop < 1:
+        parser.error("--early-stop needs at least 1 episode between checks")
+    try:
+        if args.exploration is not None:
+            exploration.parse_exploration(args.exploration)
+        if args.alpha_schedule is not None:
+            exploration.parse_alpha_schedule(args.alpha_schedule, 1.0)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.window is not None:
+        # checked before any query is solved, the grid size is read without parsing the whole grid
+        try:
+            clip_window(*read_grid_size(args.grid), args.window)
+        except (OSError, ValueError) as e:
+            parser.error(str(e))
+    stream = args.stream or args.queries == "-"
+    if stream and args.jobs != 1:
+        parser.error("--jobs can't be used when streaming queries")
     os.system('color')
     seed = random.randint(0, 1000)
-    grid_file_name = sys.argv[1]
-    queries_file_name = sys.argv[2]
-    queries = read_queries(queries_file_name)
-    for (step, method, query) in queries:
-        (grid, k, eps, a) = read_grid(grid_file_name)
-        random.seed(seed)
-        print("Step: " + str(step) + " Method: " + method)
-        if method == "MDP":
-            valueiteration.iterate(grid, step)
-            valueiteration.print_grid(grid)
-        elif method == "RL":
-            q_value_learning.iterate(grid, step, a)
-            if query == "bestPolicy":
-                q_value_learning.printgrid(grid)
-            else:
-                q_value_learning.printgridqvals(grid)
+    if args.checkpoint_dir is not None:
+        os.makedirs(args.checkpoint_dir, exist_ok=True)
+    export_to = None
+    if args.export is not None:
+        os.makedirs(args.export_dir, exist_ok=True)
+        export_to = (args.export, args.export_dir)
+    jobs = args.jobs if args.jobs > 0 else os.cpu_count()
+    with contextlib.ExitStack() as stack:
+        recorder = None
+        if args.metrics is not None:
+            recorder = Recorder(stack.enter_context(open(args.metrics, "w")))
+        if stream:
+            run_query_stream(args.grid, iter_queries(args.queries), seed,
+                             args.checkpoint_dir, args.agents, args.block_random,
+                             recorder, args.window, export_to, args.vi_processes, learning)
         else:
-            print("Unknown method: " + method)
+            run_queries(args.grid, read_queries(args.queries), seed,
+                        args.checkpoint_dir, args.agents, jobs,
+                        args.block_random, recorder, args.window, export_to,
+                        args.vi_processes, learning)
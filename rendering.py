@@ -0,0 +1,269 @@
+"""
+rendering.py
+Builds the text frames the printers in valueiteration and q_value_learning show. The policy of every cell is worked
+out once per frame and the whole frame is built in one list of strings, so printing a big grid is a single write
+instead of thousands of print calls. A window can be given to only render part of a huge grid.
+"""
+
+from grid_world import GridWorld
+from grid_store import EMPTY, EXIT, Q_ACTIONS
+from action import Action
+from color import Color
+
+# NumPy is optional, without it the policy table is worked out cell by cell
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+GREEN = str(Color.GREEN)
+RED = str(Color.RED)
+END = str(Color.END)
+UNDERLINE = str(Color.UNDERLINE)
+
+BLANK = '|         '
+UP_ARROW = '|    ^    '
+DOWN_ARROW = '|    v    '
+AGENT = '|    A    '
+
+
+def window_ranges(grid_world: GridWorld, window=None):
+    '''
+    Returns the (columns, rows) ranges of the cells in a window. window is (x, y, width, height) with y=0 the top row,
+    it is clipped to the grid. None is the whole grid
+    '''
+    return clip_window(grid_world.width, grid_world.height, window)
+
+
+def clip_window(grid_width: int, grid_height: int, window=None):
+    '''
+    window_ranges for a grid of the given size. Raises ValueError if the window has no cells in the grid
+    '''
+    if window is None:
+        return range(grid_width), range(grid_height)
+    x, y, width, height = window
+    columns = range(max(x, 0), min(x + width, grid_width))
+    rows = range(max(y, 0), min(y + height, grid_height))
+    if not columns or not rows:
+        raise ValueError("Window " + str(tuple(window)) + " is outside the " +
+                         str(grid_width) + "x" + str(grid_height) + " grid")
+    return columns, rows
+
+
+def policy_table(grid_world: GridWorld, columns, rows):
+    '''
+    Returns the best action (see GridWorld.computeActionFromValues) of every cell in the window as a dict keyed by
+    state index. Only empty cells get an entry, the printers never draw arrows on exits or boulders
+    '''
+    if np is not None:
+        return _array_policy_table(grid_world, columns, rows)
+    cell_types = grid_world.grid.cell_types
+    width = grid_world.width
+    table = {}
+    for y in rows:
+        for x in columns:
+            if cell_types[y * width + x] == EMPTY:
+                table[y * width + x] = grid_world.computeActionFromValues((x, y))
+    return table
+
+
+def _array_policy_table(grid_world: GridWorld, columns, rows):
+    '''
+    policy_table for all the cells at once with NumPy. Same order of operations and tie breaking as
+    computeActionFromValues, so it picks exactly the same actions
+    '''
+    store = grid_world.grid
+    size = store.width * store.height
+    states = (np.arange(rows.start, rows.stop)[:, None] * store.width +
+              np.arange(columns.start, columns.stop)[None, :]).ravel()
+    states = states[np.frombuffer(store.cell_types, dtype=np.uint8)[states] == EMPTY]
+    successors = np.frombuffer(grid_world.successors, dtype=np.int32).reshape(size, 4, 3)[states]
+    values = np.frombuffer(store.values)
+    best_action = np.full(len(states), -1)
+    best_score = np.zeros(len(states))
+    for action in [Action.UP, Action.DOWN, Action.RIGHT, Action.LEFT]:
+        moves = successors[:, action.value]
+        score = 0
+        for i, probability in enumerate(grid_world.transition_probabilities):
+            score = score + (grid_world.transition_cost + values[moves[:, i]] *
+                             grid_world.discount) * probability
+        better = (moves[:, 2] != states) & ((best_action < 0) | (score > best_score))
+        best_action[better] = action.value
+        best_score[better] = score[better]
+    # a state without any move keeps -1, which picks the None at the end
+    actions = [Action(value) for value in range(4)] + [None]
+    return dict(zip(states.tolist(), [actions[value] for value in best_action.tolist()]))
+
+
+def q_policy_table(grid_world: GridWorld, columns, rows):
+    '''
+    Returns the best choices (see q_value_learning.get_best_choices) of every empty cell in the window
+    as a dict keyed by state index
+    '''
+    cell_types = grid_world.grid.cell_types
+    q_values = grid_world.grid.q_values
+    width = grid_world.width
+    table = {}
+    for y in rows:
+        for x in columns:
+            state = y * width + x
+            if cell_types[state] != EMPTY:
+                continue
+            max_value = None
+            best_choices = []
+            for action, action_value in zip(Q_ACTIONS, q_values[state * 4:state * 4 + 4]):
+                if max_value is None or action_value >= max_value:
+                    if action_value == max_value:
+                        best_choices.append(action)
+                    else:
+                        best_choices = [action]
+                    max_value = action_value
+            table[state] = best_choices
+    return table
+
+
+def _value_with_arrows(val, left, right):
+    '''
+    Formats a cell value with a left and right arrow slot, 11 characters wide before the colors
+    '''
+    if val == 0:
+        color = ' '
+    elif val > 0:
+        color = GREEN + ' '
+    else:
+        color = RED
+    if abs(val) >= 10:
+        text = "{:2.3f}".format(val)
+    else:
+        text = "{:1.4f}".format(val)
+    return ('<' if left else ' ') + color + text + END + ('>' if right else ' ')
+
+
+def _short_value(val):
+    '''
+    Formats a q value with a color
+    '''
+    if val == 0:
+        color = ' '
+    elif val > 0:
+        color = GREEN + ' '
+    else:
+        color = RED
+    return color + "{:1.2f}".format(val) + END
+
+
+def value_frame(grid_world: GridWorld, window=None, show_agent=False):
+    '''
+    Returns the frame valueiteration.print_grid prints: the value and best action of each cell
+    '''
+    columns, rows = window_ranges(grid_world, window)
+    policy = policy_table(grid_world, columns, rows)
+    cell_types = grid_world.grid.cell_types
+    values = grid_world.grid.values
+    width = grid_world.width
+    line = "+---------" * len(columns) + "+\n"
+    parts = []
+    for y in rows:
+        parts.append(line)
+        for x in columns:
+            state = y * width + x
+            if show_agent and x == grid_world.agent_x and y == grid_world.agent_y:
+                parts.append(AGENT)
+            else:
+                parts.append(UP_ARROW if policy.get(state) == Action.UP else BLANK)
+        parts.append('|\n')
+        for x in columns:
+            state = y * width + x
+            best_action = policy.get(state)
+            if cell_types[state] == EMPTY or cell_types[state] == EXIT:
+                parts.append('|' + _value_with_arrows(values[state], best_action == Action.LEFT,
+                                                      best_action == Action.RIGHT))
+            else:
+                parts.append(BLANK)
+        parts.append('|\n')
+        for x in columns:
+            parts.append(DOWN_ARROW if policy.get(y * width + x) == Action.DOWN else BLANK)
+        parts.append('|\n')
+    parts.append(line)
+    return ''.join(parts)
+
+
+def q_policy_frame(grid_world: GridWorld, window=None, show_agent=False):
+    '''
+    Returns the frame q_value_learning.printgrid prints: the known value and best choices of each cell
+    '''
+    columns, rows = window_ranges(grid_world, window)
+    policy = q_policy_table(grid_world, columns, rows)
+    cell_types = grid_world.grid.cell_types
+    known_values = grid_world.grid.known_values
+    width = grid_world.width
+    line = "+---------" * len(columns) + "+\n"
+    none = ()
+    parts = []
+    for y in rows:
+        parts.append(line)
+        for x in columns:
+            parts.append(UP_ARROW if Action.UP in policy.get(y * width + x, none) else BLANK)
+        parts.append('|\n')
+        for x in columns:
+            state = y * width + x
+            actions = policy.get(state, none)
+            parts.append('|')
+            if show_agent and x == grid_world.agent_x and y == grid_world.agent_y:
+                parts.append(UNDERLINE)
+            if cell_types[state] == EMPTY or cell_types[state] == EXIT:
+                parts.append(_value_with_arrows(known_values[state], Action.LEFT in actions,
+                                                Action.RIGHT in actions))
+            else:
+                parts.append('         ')
+        parts.append('|\n')
+        for x in columns:
+            parts.append(DOWN_ARROW if Action.DOWN in policy.get(y * width + x, none) else BLANK)
+        parts.append('|\n')
+    parts.append(line)
+    return ''.join(parts)
+
+
+def q_values_frame(grid_world: GridWorld, window=None, show_agent=False):
+    '''
+    Returns the frame q_value_learning.printgridqvals prints: the four q values of each cell
+    '''
+    columns, rows = window_ranges(grid_world, window)
+    cell_types = grid_world.grid.cell_types
+    values = grid_world.grid.values
+    q_values = grid_world.grid.q_values
+    width = grid_world.width
+    up, down, left, right = (action.value for action in
+                             (Action.UP, Action.DOWN, Action.LEFT, Action.RIGHT))
+    line = "+-----------" * len(columns) + "+\n"
+    parts = []
+    for y in rows:
+        parts.append(line)
+        for x in columns:
+            state = y * width + x
+            if cell_types[state] == EMPTY:
+                parts.append('|   ' + _short_value(q_values[state * 4 + up]) + '   ')
+            else:
+                parts.append('|           ')
+        parts.append('|\n')
+        for x in columns:
+            state = y * width + x
+            if show_agent and x == grid_world.agent_x and y == grid_world.agent_y:
+                parts.append(UNDERLINE)
+            if cell_types[state] == EMPTY:
+                parts.append('|' + _short_value(q_values[state * 4 + left]) + ' ' +
+                             _short_value(q_values[state * 4 + right]))
+            elif cell_types[state] == EXIT:
+                parts.append('|  ' + _short_value(values[state]) + '   ')
+            else:
+                parts.append('|           ')
+        parts.append('|\n')
+        for x in columns:
+            state = y * width + x
+            if cell_types[state] == EMPTY:
+                parts.append('|   ' + _short_value(q_values[state * 4 + down]) + '   ')
+            else:
+                parts.append('|           ')
+        parts.append('|\n')
+    parts.append(line)
+    return ''.join(parts)
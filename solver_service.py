@@ -0,0 +1,308 @@
+"""
+solver_service.py
+A long running solver service. reader.py pays for starting python, parsing the grid and a full solve on every run,
+which is most of the time of a small query. This keeps a process running on a local unix socket instead: parsed
+grids are kept by file (and reparsed if the file changes) and solved grid worlds are kept in a bounded LRU cache
+keyed by a hash of the grid contents, the method and its settings, so a repeated query is a couple of dict lookups.
+
+The protocol is JSON lines, one request and one response per line:
+{"grid": "grid.txt", "method": "MDP", "query": "policy", "x": 1, "y": 2}
+{"ok": true, "result": "UP", "cached": true}
+method is MDP, PI or RL. query is value, policy, qvalue (needs "action": "UP", "DOWN", "LEFT" or "RIGHT") or
+qvalues. x, y is the cell with y=0 the top row. k (sweeps, policy iterations or RL steps), noise, discount,
+transition_cost, alpha and seed (RL) default to the grid file's settings (seed to 0).
+{"query": "stats"} returns the cache statistics.
+
+python solver_service.py /tmp/gridworld.sock [--cache-size N] starts the service, request() is a small client.
+"""
+
+import os
+import json
+import signal
+import socket
+import random
+import asyncio
+import hashlib
+import argparse
+from collections import OrderedDict
+from grid_world import GridWorld
+from grid_file import read_grid_file
+from grid_store import Q_ACTIONS
+import valueiteration
+import q_value_learning
+
+# NumPy is optional, without it MDP solves use the plain python value iteration
+try:
+    import array_valueiteration
+except ImportError:
+    array_valueiteration = None
+
+# PI needs NumPy and SciPy
+try:
+    import policyiteration
+except ImportError:
+    policyiteration = None
+
+METHODS = ("MDP", "PI", "RL")
+QUERIES = ("value", "policy", "qvalue", "qvalues")
+ACTIONS = {action.name: action for action in Q_ACTIONS}
+
+
+class LRUCache:
+    '''
+    Dict with at most maxsize entries, adding one more drops the least recently used
+    '''
+
+    def __init__(self, maxsize=32):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    # returns the entry of key (making it the most recently used) or None
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+
+class GridFiles:
+    '''
+    Parsed grid files with a hash of their contents, a file is parsed again when its size or modification time
+    changes
+    '''
+
+    def __init__(self):
+        # path -> ((size, modification time), digest, store, settings)
+        self.files = {}
+
+    # returns (digest, store, settings) of a grid file, store must not be changed
+    def load(self, path: str):
+        stat = os.stat(path)
+        version = (stat.st_size, stat.st_mtime_ns)
+        loaded = self.files.get(path)
+        if loaded is None or loaded[0] != version:
+            store, settings = read_grid_file(path)
+            digest = hashlib.sha1()
+            digest.update(str((store.width, store.height)).encode())
+            digest.update(store.cell_types)
+            digest.update(store.rewards)
+            loaded = (version, digest.hexdigest(), store, settings)
+            self.files[path] = loaded
+        return loaded[1:]
+
+
+def _copy_store(store):
+    '''
+    Returns a copy of a GridStore, so every solve gets its own values
+    '''
+    copy = type(store)(store.width, store.height)
+    copy.cell_types[:] = store.cell_types
+    copy.rewards[:] = store.rewards
+    copy.values[:] = store.values
+    return copy
+
+
+def solve(store, settings, method: str, k: int, noise: float, discount: float, transition_cost: float,
+          alpha: float, seed: int) -> GridWorld:
+    '''
+    Builds a grid world from a parsed grid with the given settings and solves it with method for k steps
+    '''
+    start_x, start_y = settings["Start"]
+    grid = GridWorld(_copy_store(store), start_x, start_y, noise, transition_cost, discount)
+    if method == "MDP":
+        if array_valueiteration is not None:
+            array_valueiteration.iterate(grid, k)
+        else:
+            valueiteration.iterate(grid, k)
+    elif method == "PI":
+        policyiteration.iterate(grid, k)
+    else:
+        # its own random source, so solves in different threads don't share one
+        grid.rng = random.Random(seed)
+        q_value_learning.iterate(grid, k, alpha)
+    return grid
+
+
+def answer(grid: GridWorld, method: str, query: str, x: int, y: int, action=None):
+    '''
+    Answers a query about the cell x, y (y=0 is the top row) of a solved grid world
+    '''
+    if not (0 <= x < grid.width and 0 <= y < grid.height):
+        raise ValueError("Cell " + str((x, y)) + " is outside the grid")
+    learned = method == "RL"
+    if query == "value":
+        return grid.get_known_value(x, y) if learned else grid.get_value(x, y)
+    if query == "policy":
+        if learned:
+            return [choice.name for choice in q_value_learning.get_best_choices(grid, x, y)]
+        best_action = grid.computeActionFromValues((x, y))
+        return None if best_action is None else best_action.name
+    if query == "qvalue":
+        if action not in ACTIONS:
+            raise ValueError("qvalue needs an action: " + ", ".join(ACTIONS))
+        if learned:
+            return grid.get_q_values(x, y)[ACTIONS[action]]
+        return grid.computeQValueFromValues((x, y), ACTIONS[action])
+    if query == "qvalues":
+        if learned:
+            return {choice.name: value for choice, value in grid.get_q_values(x, y).items()}
+        return {choice.name: grid.computeQValueFromValues((x, y), choice) for choice in Q_ACTIONS}
+    raise ValueError("Unknown query: " + str(query))
+
+
+class SolverService:
+    '''
+    Answers requests (see the module docstring) from cached solves. Solves run in a thread pool, a request for
+    a solve that is already running waits for it instead of starting another
+    '''
+
+    def __init__(self, cache_size=32):
+        self.grid_files = GridFiles()
+        self.cache = LRUCache(cache_size)
+        # cache key -> future of a solve that is running
+        self.solving = {}
+
+    async def _solved(self, request):
+        '''
+        Returns (solved grid world, whether it came from the cache) for a request. Raises ValueError for a
+        request that asks about a cell outside the grid or for an unknown query before solving anything
+        '''
+        method = request.get("method", "MDP")
+        if method not in METHODS:
+            raise ValueError("Unknown method: " + str(method))
+        if method == "PI" and policyiteration is None:
+            raise ValueError("PI needs NumPy and SciPy")
+        digest, store, settings = self.grid_files.load(request["grid"])
+        # checked before solving, so a bad query doesn't pay for a solve and take a cache slot
+        x, y = int(request.get("x", -1)), int(request.get("y", -1))
+        if not (0 <= x < store.width and 0 <= y < store.height):
+            raise ValueError("Cell " + str((x, y)) + " is outside the " + str(store.width) + "x" +
+                             str(store.height) + " grid")
+        if request.get("query") not in QUERIES:
+            raise ValueError("Unknown query: " + str(request.get("query")))
+        k = int(request.get("k", settings["Episodes"] if method == "RL" else settings["K"]))
+        noise = float(request.get("noise", settings["Noise"]))
+        discount = float(request.get("discount", settings["Discount"]))
+        transition_cost = float(request.get("transition_cost", settings["TransitionCost"]))
+        alpha = float(request.get("alpha", settings["alpha"])) if method == "RL" else None
+        seed = int(request.get("seed", 0)) if method == "RL" else None
+        key = (digest, method, k, noise, discount, transition_cost, alpha, seed)
+        grid = self.cache.get(key)
+        if grid is not None:
+            return grid, True
+        future = self.solving.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(None, solve, store, settings, method, k, noise, discount,
+                                          transition_cost, alpha, seed)
+            self.solving[key] = future
+            future.add_done_callback(lambda done: self._solve_done(key, done))
+        # a client going away doesn't cancel a solve other clients may be waiting for
+        return await asyncio.shield(future), False
+
+    def _solve_done(self, key, future):
+        del self.solving[key]
+        if not future.cancelled() and future.exception() is None:
+            self.cache.put(key, future.result())
+
+    async def handle(self, request) -> dict:
+        '''
+        Returns the response to a request
+        '''
+        try:
+            if not isinstance(request, dict):
+                raise ValueError("A request must be a JSON object")
+            query = request.get("query")
+            if query == "stats":
+                return {"ok": True, "result": {"entries": len(self.cache), "maxsize": self.cache.maxsize,
+                                               "hits": self.cache.hits, "misses": self.cache.misses}}
+            if "grid" not in request:
+                raise ValueError("A request needs a grid")
+            grid, cached = await self._solved(request)
+            result = answer(grid, request.get("method", "MDP"), query, int(request.get("x", -1)),
+                            int(request.get("y", -1)), request.get("action"))
+            return {"ok": True, "result": result, "cached": cached}
+        except Exception as e:
+            # anything a bad request or a failing solve raises is sent back, the connection stays usable
+            return {"ok": False, "error": type(e).__name__ + ": " + str(e)}
+
+    async def serve_client(self, reader, writer):
+        '''
+        Answers the requests of one connection until it is closed, one JSON line at a time
+        '''
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                except ValueError as e:
+                    response = {"ok": False, "error": "Bad JSON: " + str(e)}
+                else:
+                    response = await self.handle(request)
+                writer.write((json.dumps(response) + "\n").encode())
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            # the client went away or the service is stopping, ending normally keeps the cancelled
+            # connection out of the asyncio error log
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(path: str, cache_size=32):
+    '''
+    Runs the service on a unix socket at path until it gets SIGINT or SIGTERM (or is cancelled),
+    an old socket file at path is replaced
+    '''
+    if os.path.exists(path):
+        os.unlink(path)
+    service = SolverService(cache_size)
+    server = await asyncio.start_unix_server(service.serve_client, path)
+    loop = asyncio.get_running_loop()
+    stopped = loop.create_future()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, lambda: stopped.done() or stopped.set_result(None))
+    try:
+        async with server:
+            await stopped
+    finally:
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+def request(path: str, **fields):
+    '''
+    Sends one request to the service at path and returns its response
+    '''
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(path)
+        connection.sendall((json.dumps(fields) + "\n").encode())
+        with connection.makefile("rb") as responses:
+            return json.loads(responses.readline())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(usage="python solver_service.py <socket> [--cache-size N]")
+    parser.add_argument("socket", help="path of the unix socket to listen on")
+    parser.add_argument("--cache-size", type=int, default=32,
+                        help="number of solved grid worlds to keep, default 32")
+    args = parser.parse_args()
+    if args.cache_size < 1:
+        parser.error("--cache-size must be at least 1")
+    asyncio.run(serve(args.socket, args.cache_size))